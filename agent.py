@@ -1,40 +1,128 @@
 import os
+import time
 from collections.abc import Callable
+from contextvars import ContextVar
 
 import orjson
-from agents import Agent, ModelSettings, Runner, SQLiteSession
-from agents.extensions.models.litellm_model import LitellmModel
+from agents import Agent, Model, ModelSettings, OpenAIProvider, RunConfig, Runner, Session
+from agents.run import CallModelData, ModelInputData
+from langfuse import get_client
 from openai.types.shared import Reasoning
 from openai.types.responses.response_function_tool_call import ResponseFunctionToolCall
 
+from history_compaction import HistoryCompactor
+from model_routing import ModelRoute, RoutedModel
+from ollama_pool import OllamaEndpointPool
+from token_accounting import TurnUsage, current_turn_usage, input_breakdown, prompt_prefix_fingerprint
 from tools.code_execution import (
     CodeExecutionContext,
     execute_python_code,
     install_python_libraries,
 )
+from tools.metrics import TurnTimings, record_latency, timed
+from tools.scheduler import FairScheduler, parse_weights
+
+# (tenant, conversation id) of the run in progress, read by ScheduledModel
+current_request: ContextVar[tuple[str, str]] = ContextVar(
+    "current_request",
+    default=("default", "default"),
+)
+# per-phase timings of the turn in progress, for model calls (tools get them through their context)
+current_turn_timings: ContextVar[TurnTimings | None] = ContextVar("current_turn_timings", default=None)
+model_scheduler: FairScheduler | None = None
+history_compactor: HistoryCompactor | None = None
+context_window: int | None = None
+model_router: RoutedModel | None = None
+ollama_pool: OllamaEndpointPool | None = None
+
+
+class ScheduledModel(Model):
+    """
+    Wraps a model so every call first takes a slot from a FairScheduler, and records how long
+    calls queue, take to stream their first token and take overall.
+    """
+
+    def __init__(self, model: Model, scheduler: FairScheduler):
+        self.model = model
+        self.scheduler = scheduler
+
+    async def get_response(self, *args, **kwargs):
+        tenant, conversation_id = current_request.get()
+        timings = current_turn_timings.get()
+        queued_at = time.perf_counter()
+        async with self.scheduler.slot(tenant, conversation_id):
+            record_latency("model_queue", time.perf_counter() - queued_at, timings)
+            with timed("model_call", timings):
+                return await self.model.get_response(*args, **kwargs)
+
+    async def stream_response(self, *args, **kwargs):
+        tenant, conversation_id = current_request.get()
+        timings = current_turn_timings.get()
+        queued_at = time.perf_counter()
+        async with self.scheduler.slot(tenant, conversation_id):
+            started_at = time.perf_counter()
+            record_latency("model_queue", started_at - queued_at, timings)
+            first_token = True
+            async for event in self.model.stream_response(*args, **kwargs):
+                if first_token and event.type.endswith(".delta"):
+                    record_latency("model_first_token", time.perf_counter() - started_at, timings)
+                    first_token = False
+                yield event
+            record_latency("model_call", time.perf_counter() - started_at, timings)
+
+
+def prepare_model_input(data: CallModelData) -> ModelInputData:
+    """Compact the history of each model call and account for the tokens it sends."""
+    compactor, window = history_compactor, context_window
+    if model_router is not None:
+        # a routed call gets the history budget and context window of the route it goes to
+        route = model_router.route_for(data.model_data.input)
+        compactor = route.history_compactor or compactor
+        window = route.context_window or window
+    model_data = compactor(data) if compactor is not None else data.model_data
+    if (usage := current_turn_usage.get()) is not None:
+        usage.context_window = window
+        usage.record_input(input_breakdown(model_data.instructions, model_data.input, data.agent.tools))
+    return model_data
+
+
+def get_model_stats() -> dict:
+    stats = {}
+    if model_scheduler is not None:
+        stats["scheduler"] = model_scheduler.get_stats()
+    if model_router is not None:
+        stats["routing"] = model_router.get_stats()
+    if ollama_pool is not None:
+        stats["ollama"] = ollama_pool.get_stats()
+    return stats
+
+
+def init_ollama_pool(model_name: str) -> OllamaEndpointPool:
+    global ollama_pool
+
+    # calls are balanced over every endpoint in OLLAMA_ENDPOINTS (or the single OLLAMA_ENDPOINT)
+    endpoints = os.getenv("OLLAMA_ENDPOINTS") or os.getenv("OLLAMA_ENDPOINT", "http://localhost:11434")
+    ollama_pool = OllamaEndpointPool(
+        [endpoint for endpoint in endpoints.split(",") if endpoint.strip()],
+        model_name,
+        failure_threshold=int(os.getenv("OLLAMA_FAILURE_THRESHOLD", "3")),
+        cooldown=float(os.getenv("OLLAMA_CIRCUIT_COOLDOWN", "30")),
+        probe_interval=float(os.getenv("OLLAMA_PROBE_INTERVAL", "10")),
+    )
+    return ollama_pool
+
+
+def init_history_compactor(max_tokens: int) -> HistoryCompactor:
+    # older turns beyond the budget get their tool outputs and reasoning compacted
+    return HistoryCompactor(
+        max_tokens=max_tokens,
+        keep_recent_turns=int(os.getenv("HISTORY_KEEP_RECENT_TURNS", "2")),
+        max_tool_output_chars=int(os.getenv("HISTORY_MAX_TOOL_OUTPUT_CHARS", "500")),
+    )
 
 
 def init_agent():
-    if os.getenv("OPENAI_API_KEY", ""):
-        model = os.getenv("OPENAI_MODEL", "gpt-5-mini-2025-08-07")
-        print(f'Using OpenAI model: {model}')
-        model_settings = ModelSettings(
-            max_tokens=4096,
-            reasoning=Reasoning(
-                effort="medium",
-                summary="detailed",
-            ),
-        )
-    else:
-        model_name = os.getenv("OLLAMA_MODEL", "gpt-oss:20b")
-        print(f'Using Ollama model: {model_name}')
-        model = LitellmModel(
-            model=f"openai/{model_name}",
-            base_url=f"{os.getenv('OLLAMA_ENDPOINT', 'http://localhost:11434').strip('/')}/v1",
-        )
-        model_settings = ModelSettings(
-            max_tokens=4096,
-        )
+    global model_scheduler, history_compactor, context_window, model_router
 
     agent_instructions = (
         "### ROLE ###\n"
@@ -43,18 +131,89 @@ def init_agent():
         "- ALWAYS reason about the problem first to determine the best approach.\n"
         "- ALWAYS write `print` statement to return the result of the code execution.\n"
         "- For any package that is not standard python package, you could check if it is available in the sandboxed environment first and then install it if it is not available.\n"
+        "- Common data libraries imported by your code are installed automatically when missing, so just import them.\n"
         "- DON'T show any code in the final text output. Final text output should be human readable and concise.\n\n"
         "### AVAILABLE TOOLS ###\n"
         "- execute_python_code: Execute python code in a sandboxed environment and get the result.\n"
         "- install_python_libraries: Install python libraries in the sandboxed environment.\n"
     )
 
+    # instructions and tool schemas are static and sent first, so every request shares this prefix
+    tools = [execute_python_code, install_python_libraries]
+    prompt_prefix = prompt_prefix_fingerprint(agent_instructions, tools)
+
+    ollama_model_name = os.getenv("OLLAMA_MODEL", "gpt-oss:20b")
+    ollama_model_settings = ModelSettings(
+        max_tokens=4096,
+        # litellm only asks for usage in the stream when this is set
+        include_usage=True,
+    )
+
+    if os.getenv("OPENAI_API_KEY", ""):
+        model_name = os.getenv("OPENAI_MODEL", "gpt-5-mini-2025-08-07")
+        print(f'Using OpenAI model: {model_name}')
+        model = OpenAIProvider().get_model(model_name)
+        model_settings = ModelSettings(
+            max_tokens=4096,
+            reasoning=Reasoning(
+                effort="medium",
+                summary="detailed",
+            ),
+            # independent tool calls of one response are executed concurrently
+            parallel_tool_calls=True,
+            # route requests with the same prefix to the same OpenAI prompt cache
+            extra_args={"prompt_cache_key": f"code-agent-{prompt_prefix}"},
+            prompt_cache_retention=os.getenv("OPENAI_PROMPT_CACHE_RETENTION") or None,
+        )
+        # token budget for the conversation history sent to the model on each call
+        history_max_tokens = int(os.getenv("HISTORY_MAX_TOKENS") or "32000")
+        context_window = int(os.getenv("MODEL_CONTEXT_WINDOW") or "400000")
+
+        if os.getenv("MODEL_ROUTING", "false").lower() in ("1", "true", "yes"):
+            print(f'Routing simple turns to Ollama model: {ollama_model_name}')
+            route_timeout = float(os.getenv("MODEL_ROUTING_TIMEOUT", "20")) or None
+            model_router = RoutedModel(
+                simple=ModelRoute(
+                    "ollama",
+                    init_ollama_pool(ollama_model_name),
+                    ollama_model_settings,
+                    timeout=route_timeout,
+                    history_compactor=init_history_compactor(
+                        int(os.getenv("MODEL_ROUTING_SIMPLE_HISTORY_MAX_TOKENS") or "8000")
+                    ),
+                    context_window=int(os.getenv("MODEL_ROUTING_SIMPLE_CONTEXT_WINDOW") or "131072"),
+                ),
+                complex=ModelRoute("openai", model, model_settings, hosted=True, timeout=route_timeout),
+                max_simple_chars=int(os.getenv("MODEL_ROUTING_SIMPLE_MAX_CHARS", "200")),
+                cooldown=float(os.getenv("MODEL_ROUTING_COOLDOWN", "30")),
+            )
+            model = model_router
+            # each route brings its own settings; the agent's would override the simple route's
+            model_settings = ModelSettings()
+    else:
+        print(f'Using Ollama model: {ollama_model_name}')
+        model = init_ollama_pool(ollama_model_name)
+        model_settings = ollama_model_settings
+        history_max_tokens = int(os.getenv("HISTORY_MAX_TOKENS") or "8000")
+        context_window = int(os.getenv("MODEL_CONTEXT_WINDOW") or "131072")
+
+    history_compactor = init_history_compactor(history_max_tokens)
+
+    # model calls of all conversations share one fair scheduler, like the sandbox calls do
+    model_scheduler = FairScheduler(
+        capacity=int(os.getenv("SCHEDULER_MODEL_CAPACITY", "16")),
+        tenant_limit=int(os.getenv("SCHEDULER_TENANT_LIMIT", "0")) or None,
+        conversation_limit=int(os.getenv("SCHEDULER_CONVERSATION_LIMIT", "1")) or None,
+        weights=parse_weights(os.getenv("SCHEDULER_TENANT_WEIGHTS", "")),
+    )
+    model = ScheduledModel(model, model_scheduler)
+
     agent = Agent[CodeExecutionContext](
         name="code-agent",
         instructions=agent_instructions,
         model=model,
         model_settings=model_settings,
-        tools=[execute_python_code, install_python_libraries],
+        tools=tools,
     )
 
     return agent
@@ -64,46 +223,119 @@ async def run_agent(
     code_agent: Agent,
     pool,
     user_query: str,
-    session: SQLiteSession,
+    session: Session,
     reasoning_output_callback: Callable[[str], None],
     code_output_callback: Callable[[str], None],
     text_output_callback: Callable[[str], None],
+    stdout_output_callback: Callable[[str], None] | None = None,
+    tenant: str = "default",
 ) -> list[dict]:
-    """Run the agent asynchronously and return the outputs."""
-    result = Runner.run_streamed(
-        code_agent,
-        user_query,
-        context=CodeExecutionContext(pool=pool),
-        session=session,
-    )
+    """
+    Run the agent asynchronously and return the outputs.
+
+    `reasoning_output_callback` and `text_output_callback` receive reasoning summaries and the
+    answer incrementally, token by token as the model streams them. If `stdout_output_callback`
+    is given, it receives the stdout of running code incrementally, so progress of long
+    computations can be shown before they finish. `tenant` is used to schedule model and
+    sandbox calls fairly across tenants.
+    """
+    stdout_chunks = []
+
+    def _on_stdout(text: str):
+        stdout_chunks.append(text)
+        if stdout_output_callback is not None:
+            stdout_output_callback(text)
+
+    # the run's tasks copy the current context, so model calls see this request and its usage
+    request_token = current_request.set((tenant, session.session_id))
+    usage = TurnUsage(context_window=context_window)
+    usage_token = current_turn_usage.set(usage)
+    timings = TurnTimings()
+    timings_token = current_turn_timings.set(timings)
+    try:
+        turn_started_at = time.perf_counter()
+        # the agent's trace nests under this span, whose metadata then carries the turn's token accounting
+        with get_client().start_as_current_span(name="agent-turn", input=user_query) as turn_span:
+            result = Runner.run_streamed(
+                code_agent,
+                user_query,
+                context=CodeExecutionContext(
+                    pool=pool,
+                    conversation_id=session.session_id,
+                    stdout_callback=_on_stdout,
+                    tenant=tenant,
+                    timings=timings,
+                ),
+                session=session,
+                run_config=RunConfig(call_model_input_filter=prepare_model_input),
+            )
+
+            outputs = []
+            # whether the item in progress was already pushed to its callback delta by delta
+            streamed_reasoning = False
+            streamed_text = False
+            async for event in result.stream_events():
+                _reasoning_text = ""
+                _output_text = ""
+                if event.type == "raw_response_event":
+                    data = event.data
+                    if data.type == "response.reasoning_summary_text.delta":
+                        reasoning_output_callback(data.delta)
+                        streamed_reasoning = True
+                    elif data.type == "response.reasoning_summary_part.done":
+                        reasoning_output_callback("\n\n")
+                    elif data.type == "response.output_text.delta":
+                        text_output_callback(data.delta)
+                        streamed_text = True
+                    elif data.type == "response.content_part.done" and data.part.type == "output_text":
+                        text_output_callback("\n\n")
+                elif event.type == "run_item_stream_event":
+                    if event.item.type == "reasoning_item":
+                        if event.item.raw_item.summary:
+                            for summary in event.item.raw_item.summary:
+                                _reasoning_text += f"{summary.text}\n\n"
+                        if _reasoning_text:
+                            if not streamed_reasoning:
+                                reasoning_output_callback(_reasoning_text)
+                            outputs.append({"type": "reasoning", "content": _reasoning_text})
+                        streamed_reasoning = False
+                    elif (
+                        event.item.type == "tool_call_item" and 
+                        isinstance(event.item.raw_item, ResponseFunctionToolCall) and 
+                        event.item.raw_item.name == "execute_python_code"
+                    ):
+                        json_arguments = orjson.loads(event.item.raw_item.arguments)
+                        if code := json_arguments.get("code"):
+                            code_output_callback(code)
+                            outputs.append({"type": "code", "content": code})
+                    elif event.item.type == "tool_call_output_item":
+                        if stdout_chunks:
+                            outputs.append({"type": "stdout", "content": "".join(stdout_chunks)})
+                            stdout_chunks.clear()
+                        if isinstance(event.item.output, dict) and (truncated := event.item.output.get("truncated")):
+                            for summary in truncated.values():
+                                outputs.append({"type": "artifact", "content": summary["artifact"]})
+                    elif event.item.type == "message_output_item":
+                        if event.item.raw_item.content:
+                            for content in event.item.raw_item.content:
+                                _output_text += f"{content.text}\n\n"
+                        if _output_text:
+                            if not streamed_text:
+                                text_output_callback(_output_text)
+                            outputs.append({"type": "output", "content": _output_text})
+                        streamed_text = False
 
-    outputs = []
-    async for event in result.stream_events():
-        _reasoning_text = ""
-        _output_text = ""
-        if event.type == "run_item_stream_event":
-            if event.item.type == "reasoning_item":
-                if event.item.raw_item.summary:
-                    for summary in event.item.raw_item.summary:
-                        _reasoning_text += f"{summary.text}\n\n"
-                if _reasoning_text:
-                    reasoning_output_callback(_reasoning_text)
-                    outputs.append({"type": "reasoning", "content": _reasoning_text})
-            elif (
-                event.item.type == "tool_call_item" and 
-                isinstance(event.item.raw_item, ResponseFunctionToolCall) and 
-                event.item.raw_item.name == "execute_python_code"
-            ):
-                json_arguments = orjson.loads(event.item.raw_item.arguments)
-                if code := json_arguments.get("code"):
-                    code_output_callback(code)
-                    outputs.append({"type": "code", "content": code})
-            elif event.item.type == "message_output_item":
-                if event.item.raw_item.content:
-                    for content in event.item.raw_item.content:
-                        _output_text += f"{content.text}\n\n"
-                if _output_text:
-                    text_output_callback(_output_text)
-                    outputs.append({"type": "output", "content": _output_text})
-    
+            usage.record_usage(result.context_wrapper.usage)
+            outputs.append({"type": "usage", "content": usage.to_dict()})
+            record_latency("turn", time.perf_counter() - turn_started_at, timings)
+            outputs.append({"type": "latency", "content": timings.to_dict()})
+            # spans can't carry usage_details (only generations can); the instrumented model calls
+            # nested below already report their usage, so the turn totals go in the metadata
+            turn_span.update(
+                metadata={"token_usage": usage.to_dict(), "latency": timings.to_dict()},
+            )
+    finally:
+        current_turn_timings.reset(timings_token)
+        current_turn_usage.reset(usage_token)
+        current_request.reset(request_token)
     return outputs
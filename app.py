@@ -1,22 +1,31 @@
 import asyncio
 import atexit
+import queue
+import threading
 import uuid
+from collections.abc import Callable
+from pathlib import Path
 
 import streamlit as st
-from agents import SQLiteSession
 from dotenv import load_dotenv
 from langfuse import get_client
 from openinference.instrumentation.openai_agents import OpenAIAgentsInstrumentor
 
 from agent import init_agent, run_agent
-from tools.code_execution import init_code_execution_pool
+from session_store import init_session_store
+from tools.code_execution import (
+    close_conversation_kernels,
+    get_code_execution_pool_stats,
+    init_code_execution_pool,
+)
+from tools.metrics import TurnTimings, latency_recorder, timed
 
 
 @st.cache_resource
 def init_langfuse_and_agent():
     """
     This function is cached so it only runs once per Streamlit session.
-    It sets up Langfuse, the code execution pool, and the code agent.
+    It sets up Langfuse, the session store, the code execution pool, and the code agent.
     """
     load_dotenv()
     OpenAIAgentsInstrumentor().instrument()
@@ -25,16 +34,67 @@ def init_langfuse_and_agent():
     if not langfuse.auth_check():
         print("WARNING: Langfuse auth failed. Check credentials and host.")
 
+    # One session store holds the history of every conversation
+    store = init_session_store()
+    atexit.register(store.close)
+
     # Init code execution pool once
     pool = init_code_execution_pool()
 
     # Make sure pool is closed when the process exits (e.g., Ctrl-C on streamlit run)
     atexit.register(lambda: pool.close())
+    atexit.register(close_conversation_kernels)
 
     # Init agent
     agent = init_agent()
 
-    return agent, pool
+    return agent, pool, store
+
+
+@st.cache_resource
+def init_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Start one event loop in a background thread that lives across Streamlit reruns, so model
+    and sandbox connections opened by agent runs stay warm between turns.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True, name="agent-event-loop").start()
+    atexit.register(lambda: loop.call_soon_threadsafe(loop.stop))
+    return loop
+
+
+def run_on_event_loop(
+    loop: asyncio.AbstractEventLoop,
+    make_coroutine: Callable,
+    timings: TurnTimings | None = None,
+):
+    """
+    Run the coroutine built by `make_coroutine(ui)` on `loop` and wait for its result.
+
+    Streamlit elements can only be rendered from the script thread, so callbacks wrapped with
+    `ui(callback)` are queued by the loop thread and executed here while the run is in flight;
+    the time they take is recorded as `ui_render`. If the script is interrupted (e.g. the user
+    stops or reruns it), the run is cancelled.
+    """
+    ui_calls = queue.Queue()
+
+    def ui(callback: Callable) -> Callable:
+        return lambda *args: ui_calls.put((callback, args))
+
+    future = asyncio.run_coroutine_threadsafe(make_coroutine(ui), loop)
+    try:
+        while not (future.done() and ui_calls.empty()):
+            try:
+                callback, args = ui_calls.get(timeout=0.05)
+            except queue.Empty:
+                continue
+            with timed("ui_render", timings):
+                callback(*args)
+    except BaseException:
+        future.cancel()
+        raise
+
+    return future.result()
 
 
 def render_chat_history(messages: list[dict]):
@@ -46,8 +106,16 @@ def render_chat_history(messages: list[dict]):
                         render_reasoning_output(output["content"])
                     elif output["type"] == "code":
                         render_code_output(output["content"])
+                    elif output["type"] == "stdout":
+                        render_stdout_output(output["content"])
+                    elif output["type"] == "artifact":
+                        render_artifact_output(output["content"])
                     elif output["type"] == "output":
                         render_text_output(output["content"])
+                    elif output["type"] == "usage":
+                        render_usage_output(output["content"])
+                    elif output["type"] == "latency":
+                        render_latency_output(output["content"])
             else:
                 st.markdown(msg["content"])
 
@@ -62,25 +130,106 @@ def render_code_output(code: str):
         st.code(code, language="python", line_numbers=True)
 
 
+def render_stdout_output(stdout: str):
+    with st.expander("Output", expanded=False):
+        st.code(stdout, language="text")
+
+
+def render_artifact_output(path: str):
+    artifact = Path(path)
+    if artifact.exists():
+        st.download_button(
+            f"Download full output ({artifact.stat().st_size:,} bytes)",
+            data=artifact.read_bytes(),
+            file_name=artifact.name,
+            key=f"artifact-{artifact.name}",
+        )
+
+
+class TurnStream:
+    """
+    Renders an assistant turn while it streams in: reasoning and answer text grow token by
+    token, and the stdout of a running code cell grows below that cell.
+    """
+
+    def __init__(self):
+        self._kind = None
+        self._placeholder = None
+        self._text = ""
+
+    def _append(self, kind: str, chunk: str):
+        if self._kind != kind:
+            self._kind = kind
+            self._text = ""
+            if kind == "reasoning":
+                with st.expander("Reasoning", expanded=True):
+                    self._placeholder = st.empty()
+            else:
+                self._placeholder = st.empty()
+        self._text += chunk
+        if kind == "stdout":
+            self._placeholder.code(self._text, language="text")
+        else:
+            self._placeholder.markdown(self._text)
+
+    def reasoning(self, chunk: str):
+        self._append("reasoning", chunk)
+
+    def code(self, code: str):
+        render_code_output(code)
+        self._kind = "code"
+
+    def stdout(self, chunk: str):
+        self._append("stdout", chunk)
+
+    def text(self, chunk: str):
+        self._append("text", chunk)
+
+
 def render_text_output(output_text: str):
     st.markdown(f"{output_text}\n\n")
 
 
+def render_usage_output(usage: dict):
+    utilization = usage["context_utilization"]
+    st.caption(
+        f"Tokens: {usage['input_tokens']:,} in ({usage['cached_input_tokens']:,} cached), "
+        f"{usage['output_tokens']:,} out ({usage['reasoning_tokens']:,} reasoning) over "
+        f"{usage['requests']} model calls"
+        + (f" · peak context {utilization:.1%}" if utilization is not None else "")
+    )
+
+
+def render_latency_output(latency: dict):
+    st.caption("Latency: " + " · ".join(
+        f"{phase} {timing['seconds']:.2f}s" for phase, timing in latency.items()
+    ))
+
+
+def render_pool_stats():
+    with st.sidebar.expander("Sandbox pool", expanded=False):
+        st.json(get_code_execution_pool_stats())
+    with st.sidebar.expander("Latency", expanded=False):
+        st.json(latency_recorder.get_stats(), expanded=False)
+
+
 def main():
     st.set_page_config(page_title="Code Agent Chat", page_icon="💻")
     st.title("💻 Code Agent Chat with Sandbox Execution")
 
     # Initialize agent + pool (cached)
-    code_agent, pool = init_langfuse_and_agent()
+    code_agent, pool, store = init_langfuse_and_agent()
+    event_loop = init_event_loop()
 
     # Chat history state
     if "messages" not in st.session_state:
         st.session_state.messages = []
     # Conversation session
     if "session" not in st.session_state:
-        st.session_state.session = SQLiteSession(f"conversation_session_{str(uuid.uuid4())}")
+        st.session_state.session = store.session(f"conversation_session_{str(uuid.uuid4())}")
 
     render_chat_history(st.session_state.messages)
+    render_pool_stats()
 
     # User input
     user_input = st.chat_input("Ask me something that may need Python code…")
@@ -93,17 +242,30 @@ def main():
 
         # Run agent and display assistant response
         with st.chat_message("assistant"):
+            turn_stream = TurnStream()
+            ui_timings = TurnTimings()
             with st.spinner("Thinking..."):
-                # We wrap the async agent call in asyncio.run for Streamlit
-                outputs = asyncio.run(run_agent(
+                # Agent runs go to the long-lived background event loop instead of a fresh
+                # asyncio.run per turn
+                outputs = run_on_event_loop(event_loop, lambda ui: run_agent(
                     code_agent,
                     pool,
                     user_input,
                     st.session_state.session,
-                    reasoning_output_callback=render_reasoning_output,
-                    code_output_callback=render_code_output,
-                    text_output_callback=render_text_output,
-                ))
+                    reasoning_output_callback=ui(turn_stream.reasoning),
+                    code_output_callback=ui(turn_stream.code),
+                    text_output_callback=ui(turn_stream.text),
+                    stdout_output_callback=ui(turn_stream.stdout),
+                ), timings=ui_timings)
+
+            for output in outputs:
+                if output["type"] == "artifact":
+                    render_artifact_output(output["content"])
+                elif output["type"] == "usage":
+                    render_usage_output(output["content"])
+                elif output["type"] == "latency":
+                    output["content"].update(ui_timings.to_dict())
+                    render_latency_output(output["content"])
 
         st.session_state.messages.append(
             {"role": "assistant", "content": outputs}
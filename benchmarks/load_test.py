@@ -0,0 +1,160 @@
+"""
+Replay recorded conversations through `run_agent` at a fixed concurrency and report throughput,
+turn latency percentiles and sandbox pool wait.
+
+The model is the bundled stub server (or any OpenAI-compatible endpoint given with
+--model-endpoint) reached through the Ollama code path, so results reflect this process and the
+real Docker sandboxes rather than model speed. The sandbox pool is configured from the
+environment (.env) as usual.
+
+    poetry run python -m benchmarks.load_test --concurrency 8 --repeat 4
+"""
+import argparse
+import asyncio
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+
+import orjson
+import uvicorn
+from dotenv import load_dotenv
+
+from agent import init_agent, run_agent
+from benchmarks.mock_model_server import create_app, load_script
+from session_store import init_session_store
+from tools.code_execution import close_conversation_kernels, get_code_execution_pool_stats, init_code_execution_pool
+from tools.metrics import latency_recorder, summarize_durations
+
+# phases whose time is spent waiting for the sandbox pool rather than running code
+POOL_WAIT_PHASES = ("sandbox_queue", "container_acquire")
+
+
+def load_corpus(path: str) -> list[dict]:
+    """Recorded conversations, one JSON object with a `turns` list of user queries per line."""
+    with open(path, "rb") as file:
+        return [orjson.loads(line) for line in file if line.strip()]
+
+
+def start_mock_model_server(app) -> str:
+    """Serve the stub model `app` on a free local port in a background thread and return its URL."""
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True, name="mock-model-server").start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+def _ignore(text: str) -> None:
+    pass
+
+
+async def replay(agent, pool, store, conversations: list[dict], concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    turn_seconds = []
+    errors = []
+
+    async def replay_conversation(conversation: dict):
+        async with semaphore:
+            session = store.session(f"load_test_{uuid.uuid4().hex}")
+            for query in conversation["turns"]:
+                started_at = time.perf_counter()
+                try:
+                    await run_agent(
+                        agent,
+                        pool,
+                        query,
+                        session,
+                        _ignore,
+                        _ignore,
+                        _ignore,
+                        tenant=conversation.get("tenant", "default"),
+                    )
+                except Exception as error:
+                    errors.append(repr(error))
+                    # the rest of the conversation builds on the failed turn
+                    return
+                turn_seconds.append(time.perf_counter() - started_at)
+            await session.clear_session()
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(replay_conversation(conversation) for conversation in conversations))
+    wall_seconds = time.perf_counter() - started_at
+
+    return {"turn_seconds": turn_seconds, "errors": errors, "wall_seconds": wall_seconds}
+
+
+def build_report(results: dict, conversations: int, concurrency: int) -> dict:
+    phases = {
+        phase: {key: value for key, value in snapshot.items() if key != "buckets"}
+        for phase, snapshot in latency_recorder.get_stats().items()
+    }
+    turns = len(results["turn_seconds"])
+    return {
+        "conversations": conversations,
+        "concurrency": concurrency,
+        "turns": turns,
+        "errors": len(results["errors"]),
+        "wall_seconds": round(results["wall_seconds"], 3),
+        "throughput_turns_per_second": round(turns / results["wall_seconds"], 3) if results["wall_seconds"] else 0.0,
+        "turn_latency_seconds": summarize_durations(results["turn_seconds"]),
+        "pool_wait_seconds": {phase: phases[phase] for phase in POOL_WAIT_PHASES if phase in phases},
+        "phases": phases,
+        "pool": get_code_execution_pool_stats(),
+        "error_samples": results["errors"][:5],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=os.path.join(os.path.dirname(__file__), "corpus.jsonl"))
+    parser.add_argument("--concurrency", type=int, default=4, help="conversations replayed at once")
+    parser.add_argument("--repeat", type=int, default=1, help="times the corpus is replayed")
+    parser.add_argument("--model-endpoint", help="OpenAI-compatible endpoint to use instead of the bundled stub")
+    parser.add_argument("--model-script", help="JSON file of scripted replies for the stub model")
+    parser.add_argument("--model-latency", type=float, default=0.0, help="stub model seconds before each reply")
+    parser.add_argument("--model-tokens-per-second", type=float, default=0.0, help="stub model streaming rate")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    load_dotenv()
+    # the stub stands in for Ollama; sessions go to a throwaway database
+    os.environ["OPENAI_API_KEY"] = ""
+    if args.model_endpoint:
+        os.environ["OLLAMA_ENDPOINTS"] = args.model_endpoint
+    else:
+        script = load_script(args.model_script) if args.model_script else None
+        os.environ["OLLAMA_ENDPOINTS"] = start_mock_model_server(
+            create_app(script, args.model_latency, args.model_tokens_per_second)
+        )
+    db_dir = tempfile.TemporaryDirectory()
+    os.environ["SESSION_DB_PATH"] = os.path.join(db_dir.name, "sessions.db")
+
+    conversations = load_corpus(args.corpus) * args.repeat
+    store = init_session_store()
+    pool = init_code_execution_pool()
+    agent = init_agent()
+    try:
+        results = asyncio.run(replay(agent, pool, store, conversations, args.concurrency))
+        report = build_report(results, len(conversations), args.concurrency)
+    finally:
+        close_conversation_kernels()
+        pool.close()
+        store.close()
+        db_dir.cleanup()
+
+    output = orjson.dumps(report, option=orjson.OPT_INDENT_2)
+    print(output.decode())
+    if args.output:
+        with open(args.output, "wb") as file:
+            file.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+OpenAI-compatible chat completions server standing in for the model in benchmarks, so the
+agent's orchestration and sandbox performance can be measured offline and reproducibly.
+
+Replies come from an optional script, a JSON list of rules like
+
+    [{"match": "regression", "replies": [
+        {"reasoning": "Fit it.", "tool_calls": [{"name": "execute_python_code", "arguments": {"code": "..."}}]},
+        {"content": "The slope is 2."}
+    ]}]
+
+The first rule whose `match` regex is found in the turn's user message supplies the turn's
+replies, one per model call. Without a matching rule (or past its last reply), a ```python block
+in the user message is run with `execute_python_code` and anything else, including the tool's
+result, gets a short text answer.
+
+Each reply is streamed after `latency` seconds, then at `tokens_per_second` (about 4 characters
+per token; 0 streams at once). The server also answers `/api/tags`, so point OLLAMA_ENDPOINT (or
+OLLAMA_ENDPOINTS) at it and the agent uses it as its Ollama model:
+
+    poetry run python -m benchmarks.mock_model_server --port 11435 --latency 0.5 --tokens-per-second 50
+"""
+import argparse
+import asyncio
+import re
+import time
+import uuid
+
+import orjson
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+CODE_BLOCK = re.compile(r"```(?:python)?\s*\n(.*?)```", re.DOTALL)
+CHARS_PER_TOKEN = 4
+
+
+def _text(content) -> str:
+    if isinstance(content, str):
+        return content
+    return " ".join(part.get("text", "") for part in content or [] if isinstance(part, dict))
+
+
+def _tokens(text: str) -> list[str]:
+    return [text[start:start + CHARS_PER_TOKEN] for start in range(0, len(text), CHARS_PER_TOKEN)]
+
+
+def load_script(path: str) -> list[dict]:
+    with open(path, "rb") as file:
+        rules = orjson.loads(file.read())
+    for rule in rules:
+        rule["pattern"] = re.compile(rule.get("match", ""), re.IGNORECASE)
+        for reply in rule["replies"]:
+            for call in reply.get("tool_calls", []):
+                if not isinstance(call["arguments"], str):
+                    call["arguments"] = orjson.dumps(call["arguments"]).decode()
+    return rules
+
+
+def plan_reply(messages: list[dict], script: list[dict] | None = None) -> dict:
+    """The assistant message answering `messages`: `content` or `tool_calls`, and maybe `reasoning`."""
+    user_indexes = [index for index, message in enumerate(messages) if message.get("role") == "user"]
+    query = _text(messages[user_indexes[-1]].get("content")) if user_indexes else ""
+    # model calls already made this turn
+    step = sum(
+        1 for message in messages[user_indexes[-1] + 1 if user_indexes else 0:]
+        if message.get("role") == "assistant"
+    )
+
+    for rule in script or []:
+        if rule["pattern"].search(query):
+            if step < len(rule["replies"]):
+                return rule["replies"][step]
+            break
+
+    last = messages[-1] if messages else {}
+    if last.get("role") == "user" and (match := CODE_BLOCK.search(query)):
+        arguments = orjson.dumps({"code": match.group(1)}).decode()
+        return {"tool_calls": [{"name": "execute_python_code", "arguments": arguments}]}
+    if last.get("role") == "tool":
+        return {"content": f"The code ran. Its result was: {_text(last.get('content'))[:200]}"}
+    return {"content": "Sure, happy to help with that."}
+
+
+def _completion_text(reply: dict) -> str:
+    return reply.get("content") or "".join(call["arguments"] for call in reply.get("tool_calls", []))
+
+
+def _usage(messages: list[dict], reply: dict) -> dict:
+    prompt_tokens = len(orjson.dumps(messages)) // CHARS_PER_TOKEN
+    completion_tokens = max(len(_tokens(reply.get("reasoning", "") + _completion_text(reply))), 1)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+class MockModel:
+    def __init__(self, script: list[dict] | None = None, latency: float = 0.0, tokens_per_second: float = 0.0):
+        self.script = script
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+
+    def _chunk(self, completion_id: str, model: str, delta: dict, finish_reason: str | None = None) -> bytes:
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return b"data: " + orjson.dumps(chunk) + b"\n\n"
+
+    async def _pace(self) -> None:
+        if self.tokens_per_second > 0:
+            await asyncio.sleep(1 / self.tokens_per_second)
+
+    async def _stream(self, completion_id: str, model: str, messages: list[dict], reply: dict, include_usage: bool):
+        await asyncio.sleep(self.latency)
+        yield self._chunk(completion_id, model, {"role": "assistant", "content": ""})
+
+        for token in _tokens(reply.get("reasoning", "")):
+            await self._pace()
+            yield self._chunk(completion_id, model, {"reasoning_content": token})
+
+        if "tool_calls" in reply:
+            for index, call in enumerate(reply["tool_calls"]):
+                header = {"index": index, "id": f"call_{uuid.uuid4().hex[:24]}", "type": "function"}
+                yield self._chunk(completion_id, model, {
+                    "tool_calls": [{**header, "function": {"name": call["name"], "arguments": ""}}],
+                })
+                for token in _tokens(call["arguments"]):
+                    await self._pace()
+                    yield self._chunk(completion_id, model, {
+                        "tool_calls": [{"index": index, "function": {"arguments": token}}],
+                    })
+            finish_reason = "tool_calls"
+        else:
+            for token in _tokens(reply["content"]):
+                await self._pace()
+                yield self._chunk(completion_id, model, {"content": token})
+            finish_reason = "stop"
+        yield self._chunk(completion_id, model, {}, finish_reason)
+
+        if include_usage:
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [],
+                "usage": _usage(messages, reply),
+            }
+            yield b"data: " + orjson.dumps(chunk) + b"\n\n"
+        yield b"data: [DONE]\n\n"
+
+    async def chat_completions(self, request: Request):
+        body = orjson.loads(await request.body())
+        messages = body.get("messages", [])
+        model = body.get("model", "mock")
+        reply = plan_reply(messages, self.script)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        if body.get("stream"):
+            include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+            return StreamingResponse(
+                self._stream(completion_id, model, messages, reply, include_usage),
+                media_type="text/event-stream",
+            )
+
+        # not streamed: the whole reply arrives after the time streaming it would have taken
+        tokens = _usage(messages, reply)["completion_tokens"]
+        await asyncio.sleep(self.latency + (tokens / self.tokens_per_second if self.tokens_per_second > 0 else 0.0))
+        message = {"role": "assistant", "content": reply.get("content")}
+        if "reasoning" in reply:
+            message["reasoning_content"] = reply["reasoning"]
+        if "tool_calls" in reply:
+            message["tool_calls"] = [
+                {
+                    "id": f"call_{uuid.uuid4().hex[:24]}",
+                    "type": "function",
+                    "function": {"name": call["name"], "arguments": call["arguments"]},
+                }
+                for call in reply["tool_calls"]
+            ]
+        return JSONResponse({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": message,
+                "finish_reason": "tool_calls" if "tool_calls" in reply else "stop",
+            }],
+            "usage": _usage(messages, reply),
+        })
+
+    async def tags(self, request: Request):
+        return JSONResponse({"models": [{"name": "mock"}]})
+
+
+def create_app(script: list[dict] | None = None, latency: float = 0.0, tokens_per_second: float = 0.0) -> Starlette:
+    mock_model = MockModel(script, latency, tokens_per_second)
+    return Starlette(
+        routes=[
+            Route("/v1/chat/completions", mock_model.chat_completions, methods=["POST"]),
+            Route("/api/tags", mock_model.tags),
+        ],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--script", help="JSON file of scripted replies")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before each reply starts")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="streaming rate; 0 streams at once")
+    args = parser.parse_args()
+
+    script = load_script(args.script) if args.script else None
+    uvicorn.run(create_app(script, args.latency, args.tokens_per_second), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+Micro-benchmarks of the sandbox: container acquisition, interpreter startup, `session.run` and
+`run_code` overhead, `execute_python_code` on representative snippets and pip install latency.
+
+Every benchmark is run once cold (first use after the pool starts) and then `--runs` times warm.
+The results are appended as one JSON line to the history file and compared with the previous
+line, so the effect of infrastructure changes (image, warm start, stateful kernels, pool
+settings from .env) can be followed over time.
+
+    poetry run python -m benchmarks.sandbox_bench --runs 5
+"""
+import argparse
+import asyncio
+import os
+import shlex
+import statistics
+import subprocess
+import time
+import uuid
+from collections import defaultdict
+from collections.abc import Callable
+from datetime import datetime, timezone
+
+import orjson
+from agents.tool_context import ToolContext
+from dotenv import load_dotenv
+
+import tools.code_execution
+from tools.code_execution import (
+    CodeExecutionContext,
+    close_conversation_kernels,
+    code_execution_session,
+    execute_python_code,
+    init_code_execution_pool,
+    install_python_libraries,
+    run_code,
+    sandbox_session,
+)
+from tools.metrics import TurnTimings, summarize_durations
+from tools.package_cache import PackageCache
+
+SNIPPETS = {
+    "pure_python": "print(sum(i * i for i in range(1_000_000)))",
+    "pandas_load": (
+        "import io\n"
+        "import pandas as pd\n\n"
+        "csv = 'a,b,c\\n' + '\\n'.join(f'{i},{i * 2},{i % 7}' for i in range(100_000))\n"
+        "df = pd.read_csv(io.StringIO(csv))\n"
+        "print(df.groupby('c').b.mean())"
+    ),
+    "matplotlib_plot": (
+        "import matplotlib\n"
+        "matplotlib.use('Agg')\n"
+        "import matplotlib.pyplot as plt\n"
+        "import numpy as np\n\n"
+        "x = np.linspace(0, 10, 1000)\n"
+        "plt.plot(x, np.sin(x))\n"
+        "plt.savefig('plot.png')\n"
+        "print('saved plot.png')"
+    ),
+    "sklearn_fit": (
+        "import numpy as np\n"
+        "from sklearn.ensemble import RandomForestClassifier\n\n"
+        "rng = np.random.default_rng(0)\n"
+        "X = rng.normal(size=(2000, 10))\n"
+        "y = (X[:, 0] + X[:, 1] > 0).astype(int)\n"
+        "print(RandomForestClassifier(n_estimators=50, random_state=0).fit(X, y).score(X, y))"
+    ),
+}
+
+
+def cold_and_warm(samples: list[float]) -> dict:
+    """The first sample as the cold time, the rest summarized as warm times."""
+    return {"cold": samples[0], "warm": summarize_durations(samples[1:])}
+
+
+def mean_phases(timings: list[dict]) -> dict:
+    seconds = defaultdict(list)
+    for phases in timings:
+        for phase, entry in phases.items():
+            seconds[phase].append(entry["seconds"])
+    return {phase: round(statistics.fmean(values), 4) for phase, values in seconds.items()}
+
+
+def _elapsed(function, *args) -> float:
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def bench_session_overheads(pool, runs: int) -> dict:
+    samples = defaultdict(list)
+    for _ in range(runs + 1):
+        start = time.perf_counter()
+        with sandbox_session(pool) as session:
+            samples["container_acquire"].append(time.perf_counter() - start)
+            samples["interpreter_startup"].append(_elapsed(session.execute_command, "python -c pass"))
+            samples["session_run"].append(_elapsed(session.run, "pass"))
+            samples["run_code"].append(_elapsed(run_code, session, "pass"))
+    return {name: cold_and_warm(values) for name, values in samples.items()}
+
+
+async def invoke(tool, context: CodeExecutionContext, **arguments) -> dict:
+    payload = orjson.dumps(arguments).decode()
+    tool_context = ToolContext(
+        context=context,
+        tool_name=tool.name,
+        tool_call_id=f"bench_{uuid.uuid4().hex}",
+        tool_arguments=payload,
+    )
+    return await tool.on_invoke_tool(tool_context, payload)
+
+
+def reset_install(pool, conversation_id: str, package: str) -> None:
+    """
+    Uninstall `package` and forget which containers have it, so the next install_python_libraries
+    call really installs it instead of returning the package cache's no-op. A wheelhouse, if
+    configured, is kept: installing from it is the warm path being measured.
+    """
+    context = CodeExecutionContext(pool=pool, conversation_id=conversation_id)
+    with code_execution_session(context, verbose=False) as session:
+        session.execute_command(f"pip uninstall -y {shlex.quote(package)}")
+    previous = tools.code_execution.package_cache
+    tools.code_execution.package_cache = PackageCache(
+        str(previous.host_dir) if previous.host_dir is not None else None,
+        builder_image=previous.builder_image,
+        on_install=previous.on_install,
+    )
+
+
+async def bench_tool(tool, pool, runs: int, before_run: Callable[[str], None] | None = None, **arguments) -> dict:
+    """
+    Time `tool` cold and warm; the runs share a conversation, so stateful kernels stay warm.
+    `before_run` is called with the conversation id before each run, untimed.
+    """
+    conversation_id = f"bench_{uuid.uuid4().hex}"
+    samples, timings = [], []
+    installed = None
+    for run in range(runs + 1):
+        if before_run is not None:
+            before_run(conversation_id)
+        context = CodeExecutionContext(pool=pool, conversation_id=conversation_id, timings=TurnTimings())
+        start = time.perf_counter()
+        result = await invoke(tool, context, **arguments)
+        samples.append(time.perf_counter() - start)
+        if not isinstance(result, dict) or not result["success"]:
+            raise RuntimeError(f"{tool.name} failed: {result}")
+        if run == 0:
+            installed = result.get("installed")
+        timings.append(context.timings.to_dict())
+
+    report = {
+        **cold_and_warm(samples),
+        "phases": {"cold": mean_phases(timings[:1]), "warm": mean_phases(timings[1:])},
+    }
+    if installed:
+        report["installed"] = installed
+    return report
+
+
+async def bench_tools(pool, runs: int, pip_package: str) -> dict:
+    snippets = {name: await bench_tool(execute_python_code, pool, runs, code=code) for name, code in SNIPPETS.items()}
+    pip_install = await bench_tool(
+        install_python_libraries,
+        pool,
+        runs,
+        before_run=lambda conversation_id: reset_install(pool, conversation_id, pip_package),
+        libraries=[pip_package],
+    )
+    return {"snippets": snippets, "pip_install": {"package": pip_package, **pip_install}}
+
+
+def _commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _warm_p50(entry: dict) -> dict[str, float]:
+    medians = {name: result["warm"].get("p50") for name, result in entry["session"].items()}
+    medians.update({name: result["warm"].get("p50") for name, result in entry["snippets"].items()})
+    medians["pip_install"] = entry["pip_install"]["warm"].get("p50")
+    return medians
+
+
+def print_summary(entry: dict, previous: dict | None) -> None:
+    colds = {name: result["cold"] for name, result in {**entry["session"], **entry["snippets"]}.items()}
+    colds["pip_install"] = entry["pip_install"]["cold"]
+    before = _warm_p50(previous) if previous else {}
+
+    print(f"{'benchmark':<22}{'cold s':>10}{'warm p50 s':>12}{'previous':>12}")
+    for name, warm in _warm_p50(entry).items():
+        warm_text = f"{warm:.4f}" if warm is not None else "-"
+        before_text = f"{before[name]:.4f}" if before.get(name) is not None else "-"
+        print(f"{name:<22}{colds[name]:>10.4f}{warm_text:>12}{before_text:>12}")
+
+
+def read_last_entry(path: str) -> dict | None:
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as file:
+        lines = [line for line in file if line.strip()]
+    return orjson.loads(lines[-1]) if lines else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="warm runs per benchmark, after the cold one")
+    parser.add_argument("--pip-package", default="tabulate", help="small package timed with install_python_libraries")
+    parser.add_argument("--history", default=os.path.join(os.path.dirname(__file__), "results", "sandbox_bench.jsonl"))
+    args = parser.parse_args()
+
+    load_dotenv()
+    # a cached result would make the warm runs measure the cache instead of the sandbox
+    os.environ["SANDBOX_RESULT_CACHE_SIZE"] = "0"
+
+    start = time.perf_counter()
+    pool = init_code_execution_pool()
+    pool_init_seconds = time.perf_counter() - start
+    try:
+        overheads = bench_session_overheads(pool, args.runs)
+        tool_results = asyncio.run(bench_tools(pool, args.runs, args.pip_package))
+    finally:
+        close_conversation_kernels()
+        pool.close()
+
+    entry = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _commit(),
+        "image": tools.code_execution.sandbox_image,
+        "config": {name: value for name, value in sorted(os.environ.items()) if name.startswith("SANDBOX_")},
+        "runs": args.runs,
+        "pool_init_seconds": pool_init_seconds,
+        "session": overheads,
+        **tool_results,
+    }
+
+    previous = read_last_entry(args.history)
+    os.makedirs(os.path.dirname(os.path.abspath(args.history)), exist_ok=True)
+    with open(args.history, "ab") as file:
+        file.write(orjson.dumps(entry) + b"\n")
+    print_summary(entry, previous)
+    print(f"appended to {args.history}")
+
+
+if __name__ == "__main__":
+    main()
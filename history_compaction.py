@@ -0,0 +1,99 @@
+from agents import TResponseInputItem
+from agents.run import CallModelData, ModelInputData
+
+from token_accounting import item_tokens
+
+
+def _is_user_message(item: TResponseInputItem) -> bool:
+    return item.get("role") == "user" and item.get("type", "message") == "message"
+
+
+def split_turns(items: list[TResponseInputItem]) -> list[list[TResponseInputItem]]:
+    """Group items into turns, each starting at a user message."""
+    turns = []
+    for item in items:
+        if not turns or _is_user_message(item):
+            turns.append([])
+        turns[-1].append(item)
+    return turns
+
+
+class HistoryCompactor:
+    """
+    `call_model_input_filter` that keeps the model input within `max_tokens`.
+
+    The last `keep_recent_turns` turns are always sent verbatim. Older turns are compacted in
+    stages until the input fits: first their reasoning is dropped and tool outputs are cut down
+    to `max_tool_output_chars`, then their tool calls are dropped (keeping the user question
+    and the final answer), and finally the oldest turns are dropped entirely. The stored
+    session history is not modified.
+
+    Compaction aims `headroom` below the budget, so the following model calls of a turn pick
+    the same stage and send the same compacted prefix, which keeps provider prompt caches warm.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int,
+        keep_recent_turns: int = 2,
+        max_tool_output_chars: int = 500,
+        headroom: float = 0.25,
+    ):
+        self.max_tokens = max_tokens
+        self.keep_recent_turns = keep_recent_turns
+        self.max_tool_output_chars = max_tool_output_chars
+        self.headroom = headroom
+        self.compactions = 0
+
+    def _shrink(self, item: TResponseInputItem) -> TResponseInputItem | None:
+        item_type = item.get("type")
+        if item_type == "reasoning":
+            return None
+        item = dict(item)
+        # without their reasoning, output items must not reference server-side ids
+        item.pop("id", None)
+        if item_type == "function_call_output" and isinstance(item.get("output"), str):
+            output = item["output"]
+            if len(output) > self.max_tool_output_chars:
+                dropped = len(output) - self.max_tool_output_chars
+                item["output"] = output[: self.max_tool_output_chars] + f"\n... [{dropped} chars compacted]"
+        return item
+
+    def compact(self, items: list[TResponseInputItem]) -> list[TResponseInputItem]:
+        # counted the same way as the reported input tokens; each item is tokenized once per call
+        counts: dict[int, int] = {}
+
+        def _tokens(item):
+            if (count := counts.get(id(item))) is None:
+                count = counts[id(item)] = item_tokens(item)
+            return count
+
+        total = sum(_tokens(item) for item in items)
+        if total <= self.max_tokens:
+            return items
+
+        turns = split_turns(items)
+        split = max(len(turns) - self.keep_recent_turns, 0)
+        old, recent = turns[:split], turns[split:]
+        if not old:
+            return items
+        self.compactions += 1
+
+        def _size(turn_list):
+            return sum(_tokens(item) for turn in turn_list for item in turn)
+
+        budget = int(self.max_tokens * (1 - self.headroom)) - _size(recent)
+        old = [[shrunk for item in turn if (shrunk := self._shrink(item)) is not None] for turn in old]
+        if _size(old) > budget:
+            # keep the question and the answer of each turn, drop the tool calls in between
+            old = [[item for item in turn if item.get("type", "message") == "message"] for turn in old]
+        while old and _size(old) > budget:
+            old.pop(0)
+
+        return [item for turn in old + recent for item in turn]
+
+    def __call__(self, data: CallModelData) -> ModelInputData:
+        return ModelInputData(
+            input=self.compact(data.model_data.input),
+            instructions=data.model_data.instructions,
+        )
@@ -0,0 +1,204 @@
+import asyncio
+import re
+import time
+from dataclasses import dataclass
+
+from agents import Model, ModelSettings, TResponseInputItem
+from agents.models.fake_id import FAKE_RESPONSES_ID
+
+from history_compaction import HistoryCompactor
+
+COMPLEX_TURN_PATTERN = re.compile(
+    r"\b(analy[sz]\w*|dataset|data ?frame|csv|excel|plot\w*|chart|graph|regression|train\w*|"
+    r"predict\w*|forecast\w*|simulat\w*|optimi[sz]\w*|statistic\w*|correlat\w*|cluster\w*|"
+    r"compare|calculate|compute|step[- ]by[- ]step)\b",
+    re.IGNORECASE,
+)
+
+
+def _text_of(item: TResponseInputItem) -> str:
+    content = item.get("content")
+    if isinstance(content, str):
+        return content
+    return " ".join(part.get("text", "") for part in content or [] if isinstance(part, dict))
+
+
+def classify_turn(items: str | list[TResponseInputItem], max_simple_chars: int = 200) -> str:
+    """
+    Return "simple" for short follow-ups and formatting requests, "complex" otherwise.
+
+    Every model call of a turn sees the same latest user message, so a turn stays on one route.
+    """
+    if isinstance(items, str):
+        items = [{"role": "user", "content": items}]
+    user_messages = [item for item in items if item.get("role") == "user"]
+    if not user_messages:
+        return "complex"
+
+    text = _text_of(user_messages[-1])
+    is_follow_up = len(user_messages) > 1
+    if is_follow_up and len(text) <= max_simple_chars and not COMPLEX_TURN_PATTERN.search(text):
+        return "simple"
+    return "complex"
+
+
+@dataclass
+class ModelRoute:
+    name: str
+    model: Model
+    settings: ModelSettings
+    # hosted Responses API model, as opposed to a chat-completions one behind LiteLLM
+    hosted: bool = False
+    # seconds to wait for the model to start responding (to respond, when not streamed) before
+    # falling back to the other route
+    timeout: float | None = None
+    # history budget and context window of this route's model, instead of the agent-wide ones
+    history_compactor: HistoryCompactor | None = None
+    context_window: int | None = None
+
+
+class RoutedModel(Model):
+    """
+    Sends simple turns to one model and complex turns to another, falling back to the other
+    route when the chosen one fails or doesn't start responding within its timeout. A route
+    that failed is skipped for `cooldown` seconds.
+
+    Each route's own settings are the base for its calls; the settings the SDK passes in (run-level
+    settings and tool_choice adjustments) are applied on top of them.
+    """
+
+    def __init__(self, simple: ModelRoute, complex: ModelRoute, max_simple_chars: int = 200, cooldown: float = 30.0):
+        self.routes = {"simple": simple, "complex": complex}
+        self.max_simple_chars = max_simple_chars
+        self.cooldown = cooldown
+        self._down_until: dict[str, float] = {}
+        self._stats = {
+            "simple": 0,
+            "complex": 0,
+            "fallbacks": 0,
+            "failures": {simple.name: 0, complex.name: 0},
+        }
+
+    def _plan(self, input: str | list[TResponseInputItem], count: bool = True) -> list[ModelRoute]:
+        kind = classify_turn(input, self.max_simple_chars)
+        if count:
+            self._stats[kind] += 1
+        other = "complex" if kind == "simple" else "simple"
+        plan = [self.routes[kind], self.routes[other]]
+        if self._down_until.get(plan[0].name, 0.0) > time.monotonic():
+            plan.reverse()
+        return plan
+
+    def route_for(self, input: str | list[TResponseInputItem]) -> ModelRoute:
+        """The route a call with `input` would try first."""
+        return self._plan(input, count=False)[0]
+
+    def _failed(self, route: ModelRoute, error: BaseException) -> None:
+        print(f"WARNING: model route {route.name} failed, falling back: {error!r}")
+        self._down_until[route.name] = time.monotonic() + self.cooldown
+        self._stats["failures"][route.name] += 1
+        self._stats["fallbacks"] += 1
+
+    def _input_for(self, route: ModelRoute, input: str | list[TResponseInputItem]):
+        """Drop the items one backend produced that the other can't take back as input."""
+        if isinstance(input, str):
+            return input
+        prepared = []
+        for item in input:
+            # items produced through chat completions carry a placeholder id
+            from_chat_completions = item.get("id") == FAKE_RESPONSES_ID
+            if item.get("type") == "reasoning" and from_chat_completions == route.hosted:
+                continue
+            if route.hosted and from_chat_completions:
+                item = {key: value for key, value in item.items() if key != "id"}
+            prepared.append(item)
+        return prepared
+
+    async def get_response(
+        self,
+        system_instructions,
+        input,
+        model_settings,
+        tools,
+        output_schema,
+        handoffs,
+        tracing,
+        *,
+        previous_response_id=None,
+        conversation_id=None,
+        prompt=None,
+    ):
+        plan = self._plan(input)
+        for attempt, route in enumerate(plan):
+            try:
+                async with asyncio.timeout(route.timeout):
+                    return await route.model.get_response(
+                        system_instructions,
+                        self._input_for(route, input),
+                        route.settings.resolve(model_settings),
+                        tools,
+                        output_schema,
+                        handoffs,
+                        tracing,
+                        previous_response_id=previous_response_id,
+                        conversation_id=conversation_id,
+                        prompt=prompt,
+                    )
+            except Exception as error:
+                if attempt == len(plan) - 1:
+                    raise
+                self._failed(route, error)
+
+    async def stream_response(
+        self,
+        system_instructions,
+        input,
+        model_settings,
+        tools,
+        output_schema,
+        handoffs,
+        tracing,
+        *,
+        previous_response_id=None,
+        conversation_id=None,
+        prompt=None,
+    ):
+        plan = self._plan(input)
+        for attempt, route in enumerate(plan):
+            stream = route.model.stream_response(
+                system_instructions,
+                self._input_for(route, input),
+                route.settings.resolve(model_settings),
+                tools,
+                output_schema,
+                handoffs,
+                tracing,
+                previous_response_id=previous_response_id,
+                conversation_id=conversation_id,
+                prompt=prompt,
+            )
+            try:
+                # only the wait for the first event can fall back; after that it is streamed as is
+                async with asyncio.timeout(route.timeout):
+                    first_event = await anext(stream)
+            except StopAsyncIteration:
+                return
+            except Exception as error:
+                await stream.aclose()
+                if attempt == len(plan) - 1:
+                    raise
+                self._failed(route, error)
+                continue
+
+            yield first_event
+            async for event in stream:
+                yield event
+            return
+
+    def get_stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            **self._stats,
+            "failures": dict(self._stats["failures"]),
+            "down": [name for name, until in self._down_until.items() if until > now],
+        }
@@ -0,0 +1,154 @@
+import threading
+import time
+from dataclasses import dataclass
+
+import httpx
+from agents import Model
+from agents.extensions.models.litellm_model import LitellmModel
+
+
+@dataclass
+class OllamaEndpoint:
+    url: str
+    model: LitellmModel
+    healthy: bool = True
+    outstanding: int = 0
+    consecutive_failures: int = 0
+    # circuit breaker: no requests until this time, then a single trial request
+    open_until: float = 0.0
+    trial_in_flight: bool = False
+    requests: int = 0
+    failures: int = 0
+
+
+class OllamaEndpointPool(Model):
+    """
+    Spreads model calls over several Ollama endpoints serving the same model.
+
+    Each call goes to the healthy endpoint with the fewest outstanding requests. An endpoint
+    whose calls fail `failure_threshold` times in a row has its circuit opened for `cooldown`
+    seconds, after which one trial call decides whether it is closed again. A background thread
+    probes every endpoint each `probe_interval` seconds and takes unreachable ones out of
+    rotation. A call that fails before producing any output is retried on another endpoint.
+    """
+
+    def __init__(
+        self,
+        endpoints: list[str],
+        model_name: str,
+        failure_threshold: int = 3,
+        cooldown: float = 30.0,
+        probe_interval: float = 10.0,
+    ):
+        self.endpoints = [
+            OllamaEndpoint(url=url, model=LitellmModel(model=f"openai/{model_name}", base_url=f"{url}/v1"))
+            for url in (endpoint.strip().strip("/") for endpoint in endpoints)
+        ]
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.probe_interval = probe_interval
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._prober = threading.Thread(target=self._probe_loop, daemon=True, name="ollama-prober")
+        self._prober.start()
+
+    def _probe_loop(self) -> None:
+        with httpx.Client(timeout=min(self.probe_interval, 5.0)) as client:
+            while not self._stop.is_set():
+                for endpoint in self.endpoints:
+                    try:
+                        healthy = client.get(f"{endpoint.url}/api/tags").status_code == 200
+                    except httpx.HTTPError:
+                        healthy = False
+                    if endpoint.healthy and not healthy:
+                        print(f"WARNING: Ollama endpoint {endpoint.url} failed its health check")
+                    endpoint.healthy = healthy
+                self._stop.wait(self.probe_interval)
+
+    def _acquire(self, exclude: set[str]) -> OllamaEndpoint:
+        now = time.monotonic()
+        with self._lock:
+            candidates = [endpoint for endpoint in self.endpoints if endpoint.url not in exclude]
+            available = [
+                endpoint for endpoint in candidates
+                if endpoint.healthy and endpoint.open_until <= now and not endpoint.trial_in_flight
+            ]
+            # with nothing available, try the least loaded endpoint anyway rather than fail outright
+            endpoint = min(available or candidates, key=lambda endpoint: endpoint.outstanding)
+            if endpoint.consecutive_failures >= self.failure_threshold:
+                endpoint.trial_in_flight = True
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def _release(self, endpoint: OllamaEndpoint, failed: bool) -> None:
+        with self._lock:
+            endpoint.outstanding -= 1
+            endpoint.trial_in_flight = False
+            if not failed:
+                endpoint.consecutive_failures = 0
+                return
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            if endpoint.consecutive_failures >= self.failure_threshold:
+                endpoint.open_until = time.monotonic() + self.cooldown
+                print(f"WARNING: Ollama endpoint {endpoint.url} failed {endpoint.consecutive_failures} times, opening circuit")
+
+    async def get_response(self, *args, **kwargs):
+        tried = set()
+        while True:
+            endpoint = self._acquire(tried)
+            tried.add(endpoint.url)
+            try:
+                response = await endpoint.model.get_response(*args, **kwargs)
+            except Exception:
+                self._release(endpoint, failed=True)
+                if len(tried) == len(self.endpoints):
+                    raise
+                continue
+            self._release(endpoint, failed=False)
+            return response
+
+    async def stream_response(self, *args, **kwargs):
+        tried = set()
+        while True:
+            endpoint = self._acquire(tried)
+            tried.add(endpoint.url)
+            started = False
+            try:
+                async for event in endpoint.model.stream_response(*args, **kwargs):
+                    started = True
+                    yield event
+            except Exception:
+                self._release(endpoint, failed=True)
+                # once events went out the call can't be replayed elsewhere
+                if started or len(tried) == len(self.endpoints):
+                    raise
+                continue
+            except BaseException:
+                # cancelled or closed by the consumer: not the endpoint's fault
+                self._release(endpoint, failed=False)
+                raise
+            self._release(endpoint, failed=False)
+            return
+
+    def get_stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                endpoint.url: {
+                    "healthy": endpoint.healthy,
+                    "circuit": (
+                        "open" if endpoint.open_until > now
+                        else "half-open" if endpoint.consecutive_failures >= self.failure_threshold
+                        else "closed"
+                    ),
+                    "outstanding": endpoint.outstanding,
+                    "requests": endpoint.requests,
+                    "failures": endpoint.failures,
+                }
+                for endpoint in self.endpoints
+            }
+
+    def close(self) -> None:
+        self._stop.set()
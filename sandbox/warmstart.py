@@ -0,0 +1,267 @@
+"""
+Warm-start fork server for the sandbox image.
+
+`serve` imports the heavy data-analytics libraries once and then listens on a unix socket.
+`run FILE` hands the file and its own stdin/stdout/stderr to the server, which forks a child
+that executes the file with everything already imported, so snippets like
+`import pandas as pd; ...` start in milliseconds. While the server is not listening yet, `run`
+executes the file cold, starting the server in the background first if none is starting.
+`restart` replaces a running server, e.g. after packages it preloaded were upgraded.
+"""
+
+import argparse
+import json
+import os
+import resource
+import runpy
+import selectors
+import signal
+import socket
+import subprocess
+import sys
+import time
+import traceback
+
+SOCKET_PATH = os.getenv("WARMSTART_SOCKET", "/tmp/warmstart.sock")
+LOG_PATH = os.getenv("WARMSTART_LOG", "/tmp/warmstart.log")
+DEFAULT_PRELOAD = (
+    "numpy,pandas,scipy,sklearn,matplotlib,matplotlib.pyplot,seaborn,geopandas,requests"
+)
+
+
+def _preload(modules: list[str]) -> None:
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    for module in modules:
+        try:
+            __import__(module)
+        except Exception:  # noqa: BLE001
+            print(f"warmstart: failed to preload {module}", file=sys.stderr)
+            traceback.print_exc()
+
+
+def _run_child(request: dict, fds: list[int]) -> None:
+    """Execute the requested file in the forked child, then exit without returning."""
+    exit_code = 0
+    try:
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        for target, fd in enumerate(fds):
+            os.dup2(fd, target)
+            os.close(fd)
+
+        if cpu_limit := request.get("cpu_limit"):
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_limit))
+
+        os.chdir(request["cwd"])
+        path = request["path"]
+        sys.argv = [path, *request.get("args", [])]
+        sys.path.insert(0, os.path.dirname(os.path.abspath(path)))
+        runpy.run_path(path, run_name="__main__")
+    except SystemExit as e:
+        if e.code is None:
+            exit_code = 0
+        elif isinstance(e.code, int):
+            exit_code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            exit_code = 1
+    except BaseException:  # noqa: BLE001
+        traceback.print_exc()
+        exit_code = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(exit_code)
+
+
+def _pid_path(socket_path: str) -> str:
+    return socket_path + ".pid"
+
+
+def serve(socket_path: str, preload: list[str]) -> None:
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    # lets clients tell a server that is still preloading from no server at all
+    with open(_pid_path(socket_path), "w") as pid_file:
+        pid_file.write(str(os.getpid()))
+    _preload(preload)
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path + ".tmp")
+    server.listen(64)
+    # bind under a temporary name so clients never see a socket that isn't listening yet
+    os.replace(socket_path + ".tmp", socket_path)
+
+    selector = selectors.DefaultSelector()
+    selector.register(server, selectors.EVENT_READ)
+    children: dict[int, socket.socket] = {}
+
+    while True:
+        for _ in selector.select(timeout=0.05):
+            conn, _ = server.accept()
+            try:
+                message, fds, _, _ = socket.recv_fds(conn, 65536, 3)
+                request = json.loads(message)
+            except Exception:  # noqa: BLE001
+                traceback.print_exc()
+                conn.close()
+                continue
+
+            sys.stdout.flush()
+            sys.stderr.flush()
+            pid = os.fork()
+            if pid == 0:
+                server.close()
+                conn.close()
+                _run_child(request, fds)
+
+            for fd in fds:
+                os.close(fd)
+            try:
+                conn.sendall(f"pid {pid}\n".encode())
+            except OSError:
+                pass
+            children[pid] = conn
+
+        while children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            conn = children.pop(pid, None)
+            if conn is None:
+                continue
+            exit_code = os.waitstatus_to_exitcode(status)
+            if exit_code < 0:
+                # killed by a signal, report it the way a shell would
+                exit_code = 128 - exit_code
+            try:
+                conn.sendall(f"exit {exit_code}\n".encode())
+            except OSError:
+                pass
+            finally:
+                conn.close()
+
+
+def _connect(socket_path: str) -> socket.socket | None:
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        client.close()
+        return None
+    return client
+
+
+def _server_pid(socket_path: str) -> int | None:
+    """PID of the server that is starting or running, if it is still alive."""
+    try:
+        with open(_pid_path(socket_path)) as pid_file:
+            pid = int(pid_file.read().strip())
+        # the container's PID 1 doesn't reap orphans, so a dead server can linger as a zombie
+        with open(f"/proc/{pid}/stat") as stat_file:
+            state = stat_file.read().rpartition(")")[2].split()[0]
+    except (OSError, ValueError, IndexError):
+        return None
+    return None if state in ("Z", "X") else pid
+
+
+def _start_server(socket_path: str) -> None:
+    with open(LOG_PATH, "ab") as log:
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "serve", "--socket", socket_path],
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=log,
+            start_new_session=True,
+        )
+
+
+def restart(socket_path: str) -> None:
+    if (pid := _server_pid(socket_path)) is not None:
+        os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + 5.0
+        while _server_pid(socket_path) == pid and time.monotonic() < deadline:
+            time.sleep(0.05)
+    for path in (socket_path, _pid_path(socket_path)):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+    _start_server(socket_path)
+
+
+def run(path: str, args: list[str], socket_path: str, cpu_limit: int | None = None) -> int:
+    client = _connect(socket_path)
+    if client is None:
+        # don't wait for the preload, which takes longer than a cold run; later runs get the server
+        if _server_pid(socket_path) is None:
+            _start_server(socket_path)
+        if cpu_limit:
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_limit))
+        sys.argv = [path, *args]
+        sys.path.insert(0, os.path.dirname(os.path.abspath(path)))
+        runpy.run_path(path, run_name="__main__")
+        return 0
+
+    request = {"path": path, "args": args, "cwd": os.getcwd(), "cpu_limit": cpu_limit}
+    socket.send_fds(client, [json.dumps(request).encode()], [0, 1, 2])
+
+    child_pid = None
+
+    def _forward(signum, _frame):
+        if child_pid is not None:
+            os.kill(child_pid, signum)
+
+    signal.signal(signal.SIGINT, _forward)
+    signal.signal(signal.SIGTERM, _forward)
+
+    for line in client.makefile("r"):
+        kind, _, value = line.strip().partition(" ")
+        if kind == "pid":
+            child_pid = int(value)
+        elif kind == "exit":
+            return int(value)
+
+    # server went away before reporting an exit status
+    return 1
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve")
+    serve_parser.add_argument("--socket", default=SOCKET_PATH)
+    serve_parser.add_argument(
+        "--preload",
+        default=os.getenv("WARMSTART_PRELOAD", DEFAULT_PRELOAD),
+        help="comma separated modules to import before forking",
+    )
+
+    restart_parser = subparsers.add_parser("restart")
+    restart_parser.add_argument("--socket", default=SOCKET_PATH)
+
+    run_parser = subparsers.add_parser("run")
+    run_parser.add_argument("--socket", default=SOCKET_PATH)
+    run_parser.add_argument("--cpu-limit", type=int, default=None, help="CPU seconds before the run is killed")
+    run_parser.add_argument("path")
+    run_parser.add_argument("args", nargs=argparse.REMAINDER)
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        serve(args.socket, [m.strip() for m in args.preload.split(",") if m.strip()])
+    elif args.command == "restart":
+        restart(args.socket)
+    else:
+        sys.exit(run(args.path, args.args, args.socket, args.cpu_limit))
+
+
+if __name__ == "__main__":
+    main()
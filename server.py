@@ -0,0 +1,309 @@
+import asyncio
+import os
+import secrets
+import uuid
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import orjson
+from dotenv import load_dotenv
+from langfuse import get_client
+from openinference.instrumentation.openai_agents import OpenAIAgentsInstrumentor
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route, WebSocketRoute
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+from agent import get_model_stats, init_agent, run_agent
+from session_store import SessionStore, init_session_store
+from tools.code_execution import (
+    close_conversation_kernel,
+    close_conversation_kernels,
+    get_artifact_path,
+    get_code_execution_pool_stats,
+    init_code_execution_pool,
+)
+from tools.metrics import latency_recorder
+
+
+class Conversation:
+    def __init__(self, conversation_id: str, store: SessionStore):
+        self.conversation_id = conversation_id
+        self.session = store.session(f"conversation_session_{conversation_id}")
+        # turns of one conversation share its history, so they run one at a time
+        self.lock = asyncio.Lock()
+
+
+class AgentService:
+    """One agent and one sandbox pool shared by every conversation served by this process."""
+
+    def __init__(self):
+        self.agent = None
+        self.pool = None
+        self.store = None
+        self.conversations: dict[str, Conversation] = {}
+        # API key -> tenant; when empty, tenants come from a header a trusted proxy sets, if trusted
+        self.api_keys: dict[str, str] = {}
+        self.trust_tenant_header = False
+
+    def start(self):
+        load_dotenv()
+        self.api_keys = parse_api_keys(os.getenv("SERVER_API_KEYS", ""))
+        self.trust_tenant_header = os.getenv("SERVER_TRUST_TENANT_HEADER", "false").lower() in ("1", "true", "yes")
+        OpenAIAgentsInstrumentor().instrument()
+
+        langfuse = get_client()
+        if not langfuse.auth_check():
+            print("WARNING: Langfuse auth failed. Check credentials and host.")
+
+        self.store = init_session_store()
+        self.pool = init_code_execution_pool()
+        self.agent = init_agent()
+
+    def stop(self):
+        close_conversation_kernels()
+        if self.pool is not None:
+            self.pool.close()
+        if self.store is not None:
+            self.store.close()
+
+    def create_conversation(self) -> Conversation:
+        conversation = Conversation(uuid.uuid4().hex, self.store)
+        self.conversations[conversation.conversation_id] = conversation
+        return conversation
+
+    async def get_conversation(self, conversation_id: str) -> Conversation | None:
+        """Look up a conversation, reopening it from the session store if it has history there."""
+        if (conversation := self.conversations.get(conversation_id)) is not None:
+            return conversation
+        if not await self.store.has_session(f"conversation_session_{conversation_id}"):
+            return None
+        return self.conversations.setdefault(conversation_id, Conversation(conversation_id, self.store))
+
+    async def delete_conversation(self, conversation_id: str) -> bool:
+        conversation = await self.get_conversation(conversation_id)
+        if conversation is None:
+            return False
+        self.conversations.pop(conversation_id, None)
+        await conversation.session.clear_session()
+        close_conversation_kernel(conversation.session.session_id)
+        return True
+
+    async def _drop_if_idle(self, conversation: Conversation) -> None:
+        """
+        Forget a conversation nobody is running a turn of; `get_conversation` reopens it from
+        the store, so only conversations with stored history are dropped.
+        """
+        if conversation.lock.locked():
+            return
+        if not await self.store.has_session(conversation.session.session_id):
+            return
+        # a turn may have started while the store was checked
+        if not conversation.lock.locked() and self.conversations.get(conversation.conversation_id) is conversation:
+            del self.conversations[conversation.conversation_id]
+
+    async def stream_turn(self, conversation: Conversation, message: str, tenant: str = "default"):
+        """Run one agent turn and yield its events as they happen: (event type, payload)."""
+        events = asyncio.Queue()
+
+        def _emit(event_type: str):
+            return lambda content: events.put_nowait((event_type, {"content": content}))
+
+        async def _run():
+            try:
+                async with conversation.lock:
+                    return await run_agent(
+                        self.agent,
+                        self.pool,
+                        message,
+                        conversation.session,
+                        reasoning_output_callback=_emit("reasoning"),
+                        code_output_callback=_emit("code"),
+                        text_output_callback=_emit("output"),
+                        stdout_output_callback=_emit("stdout"),
+                        tenant=tenant,
+                    )
+            finally:
+                await self._drop_if_idle(conversation)
+
+        task = asyncio.create_task(_run())
+        task.add_done_callback(lambda _: events.put_nowait(None))
+        try:
+            while (event := await events.get()) is not None:
+                yield event
+
+            if task.cancelled():
+                yield "error", {"error": "cancelled"}
+            elif (error := task.exception()) is not None:
+                yield "error", {"error": str(error)}
+            else:
+                outputs = task.result()
+                for output in outputs:
+                    if output["type"] == "artifact":
+                        # clients download the full output through GET /artifacts/{name}
+                        output["content"] = f"/artifacts/{Path(output['content']).name}"
+                        yield "artifact", {"content": output["content"]}
+                yield "done", {"outputs": outputs}
+        finally:
+            # the client went away mid-turn: stop the run, including any code it is executing
+            if not task.done():
+                task.cancel()
+
+
+service = AgentService()
+
+
+def _sse(event_type: str, payload: dict) -> bytes:
+    return b"event: " + event_type.encode() + b"\ndata: " + orjson.dumps(payload) + b"\n\n"
+
+
+def parse_api_keys(value: str) -> dict[str, str]:
+    """Parse "key-a=tenant-a,key-b=tenant-b" into a key -> tenant mapping."""
+    api_keys = {}
+    for entry in value.split(","):
+        key, _, tenant = entry.strip().partition("=")
+        if key and tenant:
+            api_keys[key.strip()] = tenant.strip()
+    return api_keys
+
+
+def _tenant(connection: Request | WebSocket) -> str | None:
+    """
+    Tenant a request is scheduled as, or None when it isn't authenticated.
+
+    With SERVER_API_KEYS set the tenant is the one of the bearer token. Otherwise the
+    X-Tenant-Id header is only honoured with SERVER_TRUST_TENANT_HEADER, for deployments where
+    a trusted proxy sets it; any client could claim any tenant with it.
+    """
+    if service.api_keys:
+        scheme, _, token = connection.headers.get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer":
+            return None
+        for key, tenant in service.api_keys.items():
+            if secrets.compare_digest(token.strip(), key):
+                return tenant
+        return None
+    if service.trust_tenant_header:
+        return connection.headers.get("x-tenant-id", "default")
+    return "default"
+
+
+async def create_conversation(request: Request):
+    conversation = service.create_conversation()
+    return JSONResponse({"conversation_id": conversation.conversation_id}, status_code=201)
+
+
+async def delete_conversation(request: Request):
+    if not await service.delete_conversation(request.path_params["conversation_id"]):
+        return JSONResponse({"error": "conversation not found"}, status_code=404)
+    return Response(status_code=204)
+
+
+async def post_message(request: Request):
+    """Run one turn and stream its events as server-sent events."""
+    if (tenant := _tenant(request)) is None:
+        return JSONResponse({"error": "unauthorized"}, status_code=401)
+    conversation = await service.get_conversation(request.path_params["conversation_id"])
+    if conversation is None:
+        return JSONResponse({"error": "conversation not found"}, status_code=404)
+
+    try:
+        body = await request.json()
+    except ValueError:
+        return JSONResponse({"error": "body must be JSON"}, status_code=400)
+    if not isinstance(body, dict) or not (message := body.get("message")):
+        return JSONResponse({"error": "message is required"}, status_code=400)
+
+    async def _events():
+        async for event_type, payload in service.stream_turn(conversation, message, tenant):
+            yield _sse(event_type, payload)
+
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def conversation_websocket(websocket: WebSocket):
+    """Each received `{"message": ...}` runs one turn; its events are sent back as JSON."""
+    conversation = await service.get_conversation(websocket.path_params["conversation_id"])
+    await websocket.accept()
+    if (tenant := _tenant(websocket)) is None:
+        await websocket.close(code=4401, reason="unauthorized")
+        return
+    if conversation is None:
+        await websocket.close(code=4404, reason="conversation not found")
+        return
+
+    try:
+        while True:
+            try:
+                body = orjson.loads(await websocket.receive_text())
+            except orjson.JSONDecodeError:
+                await websocket.send_json({"type": "error", "error": "message must be JSON"})
+                continue
+            if not isinstance(body, dict) or not (message := body.get("message")):
+                await websocket.send_json({"type": "error", "error": "message is required"})
+                continue
+            async for event_type, payload in service.stream_turn(conversation, message, tenant):
+                await websocket.send_text(orjson.dumps({"type": event_type, **payload}).decode())
+    except WebSocketDisconnect:
+        pass
+
+
+async def get_artifact(request: Request):
+    """Full stdout/stderr of a run whose output was truncated."""
+    if (path := get_artifact_path(request.path_params["name"])) is None:
+        return JSONResponse({"error": "artifact not found"}, status_code=404)
+    return FileResponse(path, media_type="text/plain; charset=utf-8", filename=path.name)
+
+
+async def health(request: Request):
+    return JSONResponse({"status": "ok"})
+
+
+async def stats(request: Request):
+    return JSONResponse({
+        "conversations": len(service.conversations),
+        "sandbox": get_code_execution_pool_stats(),
+        "model": get_model_stats(),
+        "sessions": service.store.get_stats(),
+        "latency": latency_recorder.get_stats(),
+    })
+
+
+async def metrics(request: Request):
+    """Per-phase latency histograms in Prometheus text format."""
+    return PlainTextResponse(latency_recorder.prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@asynccontextmanager
+async def lifespan(app: Starlette):
+    service.start()
+    try:
+        yield
+    finally:
+        service.stop()
+
+
+app = Starlette(
+    routes=[
+        Route("/conversations", create_conversation, methods=["POST"]),
+        Route("/conversations/{conversation_id}", delete_conversation, methods=["DELETE"]),
+        Route("/conversations/{conversation_id}/messages", post_message, methods=["POST"]),
+        WebSocketRoute("/conversations/{conversation_id}/ws", conversation_websocket),
+        Route("/artifacts/{name}", get_artifact),
+        Route("/healthz", health),
+        Route("/stats", stats),
+        Route("/metrics", metrics),
+    ],
+    lifespan=lifespan,
+)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,304 @@
+import asyncio
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import orjson
+from agents.items import TResponseInputItem
+from agents.memory import SessionABC
+
+session_store = None
+
+
+class SessionWriteError(RuntimeError):
+    """An earlier write of a session failed, so its stored history is incomplete."""
+
+
+@dataclass
+class _Write:
+    kind: str
+    session_id: str
+    items: list | None = None
+    future: Future = field(default_factory=Future)
+
+
+class SessionStore:
+    """
+    Conversation history for every session in one WAL-mode SQLite database.
+
+    Reads run on a small pool of threads that each keep their own connection, so they never
+    block the event loop and can proceed while a write is in flight. Writes are queued to a
+    single writer thread that commits everything queued within `linger` seconds (up to
+    `batch_size` operations) in one transaction; `add_items` returns once the write is queued,
+    and a read of the same session waits for its queued writes first. If a queued `add_items`
+    write fails, the next `get_items` or `add_items` of that session raises SessionWriteError.
+    """
+
+    def __init__(
+        self,
+        db_path: str = "sessions.db",
+        read_connections: int = 4,
+        batch_size: int = 256,
+        linger: float = 0.005,
+    ):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.linger = linger
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._last_write: dict[str, Future] = {}
+        # error of the last failed add_items write per session, raised to its next caller
+        self._failed_writes: dict[str, BaseException] = {}
+        self._writes: queue.Queue[_Write | None] = queue.Queue()
+        self._batches = 0
+        self._written = 0
+
+        self._init_schema(self._connect())
+        self._readers = ThreadPoolExecutor(max_workers=read_connections, thread_name_prefix="session-reader")
+        self._writer = threading.Thread(target=self._write_loop, daemon=True, name="session-writer")
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def _init_schema(self, conn: sqlite3.Connection) -> None:
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                message_data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_messages_session_id ON messages (session_id, id);
+            """
+        )
+
+    def _reader_connection(self) -> sqlite3.Connection:
+        if not hasattr(self._local, "connection"):
+            self._local.connection = self._connect()
+        return self._local.connection
+
+    async def _read(self, session_id: str, fn):
+        # read-your-writes: writes are applied in order, so waiting for the latest is enough
+        with self._lock:
+            pending = self._last_write.get(session_id)
+        if pending is not None:
+            try:
+                await asyncio.wrap_future(pending)
+            except Exception:  # noqa: BLE001
+                # a failed add_items write is raised below, other writes raised to their own caller
+                pass
+        self._raise_failed_write(session_id)
+        return await asyncio.get_running_loop().run_in_executor(
+            self._readers, lambda: fn(self._reader_connection())
+        )
+
+    def _raise_failed_write(self, session_id: str) -> None:
+        with self._lock:
+            error = self._failed_writes.pop(session_id, None)
+        if error is not None:
+            raise SessionWriteError(f"an earlier write of session {session_id} failed: {error}") from error
+
+    def _enqueue(self, write: _Write) -> Future:
+        with self._lock:
+            self._last_write[write.session_id] = write.future
+
+        def _forget(future: Future):
+            with self._lock:
+                if self._last_write.get(write.session_id) is future:
+                    del self._last_write[write.session_id]
+                # nobody awaits add_items writes, so their failure is kept for the session's next call
+                if write.kind == "add" and (error := future.exception()) is not None:
+                    self._failed_writes[write.session_id] = error
+                elif write.kind == "clear" and future.exception() is None:
+                    self._failed_writes.pop(write.session_id, None)
+
+        write.future.add_done_callback(_forget)
+        self._writes.put(write)
+        return write.future
+
+    def _apply(self, conn: sqlite3.Connection, write: _Write):
+        if write.kind == "add":
+            conn.execute("INSERT OR IGNORE INTO sessions (session_id) VALUES (?)", (write.session_id,))
+            conn.executemany(
+                "INSERT INTO messages (session_id, message_data) VALUES (?, ?)",
+                [(write.session_id, orjson.dumps(item).decode()) for item in write.items],
+            )
+            conn.execute(
+                "UPDATE sessions SET updated_at = CURRENT_TIMESTAMP WHERE session_id = ?",
+                (write.session_id,),
+            )
+            return None
+        if write.kind == "pop":
+            row = conn.execute(
+                "SELECT id, message_data FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT 1",
+                (write.session_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM messages WHERE id = ?", (row[0],))
+            return orjson.loads(row[1])
+        if write.kind == "clear":
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (write.session_id,))
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (write.session_id,))
+            return None
+        raise ValueError(f"unknown write: {write.kind}")
+
+    def _commit(self, conn: sqlite3.Connection, batch: list[_Write]) -> None:
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            results = [self._apply(conn, write) for write in batch]
+            conn.execute("COMMIT")
+        except Exception as error:
+            try:
+                conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                # nothing to roll back if BEGIN itself failed
+                pass
+            if len(batch) > 1:
+                # isolate the failing write so it doesn't take the rest of the batch with it
+                for write in batch:
+                    self._commit(conn, [write])
+                return
+            print(f"WARNING: failed to write session {batch[0].session_id}: {error}")
+            batch[0].future.set_exception(error)
+            return
+
+        self._batches += 1
+        self._written += len(batch)
+        for write, result in zip(batch, results):
+            write.future.set_result(result)
+
+    def _write_loop(self) -> None:
+        conn = self._connect()
+        stopping = False
+        while not stopping:
+            write = self._writes.get()
+            if write is None:
+                break
+            batch = [write]
+            deadline = time.monotonic() + self.linger
+            while len(batch) < self.batch_size:
+                try:
+                    write = self._writes.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if write is None:
+                    stopping = True
+                    break
+                batch.append(write)
+            try:
+                self._commit(conn, batch)
+            except Exception as error:  # noqa: BLE001
+                # keep the writer alive, or every later write would wait forever
+                print(f"WARNING: failed to write session batch: {error}")
+                for write in batch:
+                    if not write.future.done():
+                        write.future.set_exception(error)
+
+    async def get_items(self, session_id: str, limit: int | None = None) -> list[TResponseInputItem]:
+        def _get_items(conn: sqlite3.Connection):
+            if limit is None:
+                rows = conn.execute(
+                    "SELECT message_data FROM messages WHERE session_id = ? ORDER BY id",
+                    (session_id,),
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT message_data FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                    (session_id, limit),
+                ).fetchall()[::-1]
+            return [orjson.loads(message_data) for (message_data,) in rows]
+
+        return await self._read(session_id, _get_items)
+
+    async def add_items(self, session_id: str, items: list[TResponseInputItem]) -> None:
+        self._raise_failed_write(session_id)
+        if items:
+            self._enqueue(_Write("add", session_id, list(items)))
+
+    async def pop_item(self, session_id: str) -> TResponseInputItem | None:
+        return await asyncio.wrap_future(self._enqueue(_Write("pop", session_id)))
+
+    async def clear_session(self, session_id: str) -> None:
+        await asyncio.wrap_future(self._enqueue(_Write("clear", session_id)))
+
+    async def has_session(self, session_id: str) -> bool:
+        def _has_session(conn: sqlite3.Connection):
+            return conn.execute("SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)).fetchone() is not None
+
+        return await self._read(session_id, _has_session)
+
+    def session(self, session_id: str) -> "StoreSession":
+        return StoreSession(session_id, self)
+
+    def get_stats(self) -> dict:
+        return {
+            "queued_writes": self._writes.qsize(),
+            "batches": self._batches,
+            "writes": self._written,
+        }
+
+    def close(self) -> None:
+        """Commit queued writes and close every connection."""
+        self._writes.put(None)
+        self._writer.join()
+        self._readers.shutdown(wait=True)
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+
+
+class StoreSession(SessionABC):
+    """Agents SDK session backed by a shared SessionStore."""
+
+    def __init__(self, session_id: str, store: SessionStore):
+        self.session_id = session_id
+        self.store = store
+
+    async def get_items(self, limit: int | None = None) -> list[TResponseInputItem]:
+        return await self.store.get_items(self.session_id, limit)
+
+    async def add_items(self, items: list[TResponseInputItem]) -> None:
+        await self.store.add_items(self.session_id, items)
+
+    async def pop_item(self) -> TResponseInputItem | None:
+        return await self.store.pop_item(self.session_id)
+
+    async def clear_session(self) -> None:
+        await self.store.clear_session(self.session_id)
+
+    def close(self) -> None:
+        # connections belong to the store, which outlives its sessions
+        pass
+
+
+def init_session_store() -> SessionStore:
+    global session_store
+
+    if session_store is not None:
+        return session_store
+
+    session_store = SessionStore(
+        db_path=os.getenv("SESSION_DB_PATH", "sessions.db"),
+        read_connections=int(os.getenv("SESSION_DB_READ_CONNECTIONS", "4")),
+        batch_size=int(os.getenv("SESSION_DB_WRITE_BATCH_SIZE", "256")),
+    )
+    return session_store
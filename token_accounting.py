@@ -0,0 +1,134 @@
+import hashlib
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+import orjson
+from agents import FunctionTool, TResponseInputItem, Usage
+
+try:
+    import tiktoken
+except ImportError:  # fall back to a byte-length estimate
+    tiktoken = None
+
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with tiktoken's o200k encoding when available, otherwise estimate them."""
+    global _encoding
+
+    if tiktoken is None:
+        return len(text.encode("utf-8", errors="replace")) // 4
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding("o200k_base")
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def prompt_prefix_fingerprint(instructions: str, tools: list) -> str:
+    """Hash of the static prompt prefix (instructions and tool schemas) shared by every request."""
+    prefix = instructions + "".join(
+        tool.name + (tool.description or "") + orjson.dumps(tool.params_json_schema, option=orjson.OPT_SORT_KEYS).decode()
+        for tool in tools
+        if isinstance(tool, FunctionTool)
+    )
+    return hashlib.sha256(prefix.encode()).hexdigest()[:16]
+
+
+def item_tokens(item: TResponseInputItem) -> int:
+    """Tokens of an input item as sent to the model, i.e. of its JSON."""
+    return count_tokens(orjson.dumps(item).decode())
+
+
+def input_breakdown(
+    instructions: str | None,
+    items: list[TResponseInputItem],
+    tools: list,
+) -> dict[str, int]:
+    """
+    Split the tokens of one model call's input into instructions, tool schemas, earlier
+    history, tool outputs and the current turn (from the latest user message on).
+    """
+    current_start = 0
+    for index, item in enumerate(items):
+        if item.get("role") == "user" and item.get("type", "message") == "message":
+            current_start = index
+
+    breakdown = {
+        "instructions": count_tokens(instructions or ""),
+        "tools": sum(
+            count_tokens(tool.name + (tool.description or "") + orjson.dumps(tool.params_json_schema).decode())
+            for tool in tools
+            if isinstance(tool, FunctionTool)
+        ),
+        "history": 0,
+        "tool_outputs": 0,
+        "current_turn": 0,
+    }
+    for index, item in enumerate(items):
+        if item.get("type") == "function_call_output":
+            breakdown["tool_outputs"] += item_tokens(item)
+        elif index < current_start:
+            breakdown["history"] += item_tokens(item)
+        else:
+            breakdown["current_turn"] += item_tokens(item)
+    breakdown["total"] = sum(breakdown.values())
+    return breakdown
+
+
+@dataclass
+class TurnUsage:
+    """Token accounting of one `run_agent` turn against the model's context window."""
+
+    context_window: int | None = None
+    calls: list[dict[str, int]] = field(default_factory=list)
+    requests: int = 0
+    input_tokens: int = 0
+    cached_input_tokens: int = 0
+    output_tokens: int = 0
+    reasoning_tokens: int = 0
+    request_usage: list[dict[str, int]] = field(default_factory=list)
+
+    def record_input(self, breakdown: dict[str, int]) -> None:
+        self.calls.append(breakdown)
+
+    def record_usage(self, usage: Usage) -> None:
+        """Take the provider-reported totals of the run."""
+        self.requests = usage.requests
+        self.input_tokens = usage.input_tokens
+        self.cached_input_tokens = usage.input_tokens_details.cached_tokens or 0
+        self.output_tokens = usage.output_tokens
+        self.reasoning_tokens = usage.output_tokens_details.reasoning_tokens or 0
+        self.request_usage = [
+            {
+                "input_tokens": entry.input_tokens,
+                "cached_input_tokens": entry.input_tokens_details.cached_tokens or 0,
+                "output_tokens": entry.output_tokens,
+            }
+            for entry in usage.request_usage_entries
+        ]
+
+    def to_dict(self) -> dict:
+        peak = max((call["total"] for call in self.calls), default=0)
+        totals = {}
+        for call in self.calls:
+            for part, tokens in call.items():
+                totals[part] = totals.get(part, 0) + tokens
+        return {
+            "requests": self.requests,
+            "input_tokens": self.input_tokens,
+            "cached_input_tokens": self.cached_input_tokens,
+            "output_tokens": self.output_tokens,
+            "reasoning_tokens": self.reasoning_tokens,
+            # share of input tokens served from the provider's prompt cache, as reported by it
+            "cache_hit_rate": round(self.cached_input_tokens / self.input_tokens, 4) if self.input_tokens else None,
+            "request_usage": self.request_usage,
+            # counted locally from what was sent, summed over the turn's model calls
+            "input_breakdown": totals,
+            "peak_input_tokens": peak,
+            "context_window": self.context_window,
+            "context_utilization": round(peak / self.context_window, 4) if self.context_window else None,
+        }
+
+
+# accounting of the turn in progress, filled in by the model input filter in agent.py
+current_turn_usage: ContextVar[TurnUsage | None] = ContextVar("current_turn_usage", default=None)
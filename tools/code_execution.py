@@ -1,59 +1,590 @@
 import asyncio
+import codecs
+import os
+import shlex
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from concurrent.futures import Future
+from collections.abc import Callable, Iterator
+from contextlib import asynccontextmanager, contextmanager
 from dataclasses import dataclass
+from pathlib import Path
 
 from agents import RunContextWrapper, function_tool
-from llm_sandbox import SandboxSession
-from llm_sandbox.pool import create_pool_manager, PoolConfig
-from llm_sandbox.pool.base import ContainerPoolManager
+from llm_sandbox import InteractiveSandboxSession, SandboxSession
+from llm_sandbox.data import ConsoleOutput
+from llm_sandbox.pool import PoolConfig
+from llm_sandbox.pool.base import ContainerPoolManager, PooledContainer
+from llm_sandbox.pool.docker_pool import DockerPoolManager
+
+from tools.dependencies import DEFAULT_AUTO_INSTALL, DependencyResolver, parse_allowlist
+from tools.executor import SandboxExecutor
+from tools.kernels import ConversationKernels
+from tools.metrics import TurnTimings, record_latency, summarize_durations, timed
+from tools.output_limits import OutputLimiter
+from tools.package_cache import PackageCache
+from tools.result_cache import ResultCache, is_probably_deterministic, result_key
+from tools.run_control import RunControl
+from tools.scheduler import FairScheduler, parse_weights
+
+# default sandbox image; SANDBOX_IMAGE points at another one, e.g. a local build of the Dockerfile
+SANDBOX_IMAGE = "chihyuyeh/python-data-analytics:0.0.1"
+WARM_START_SCRIPT = "/opt/warmstart/warmstart.py"
+CPU_LIMIT_MESSAGE = "CPU time limit exceeded"
+# going over the soft RLIMIT_CPU sends SIGXCPU, which would kill the kernel's runner and leave the
+# cell waiting for a result forever; raising in the handler fails just the cell instead
+KERNEL_CPU_LIMIT_CELL = (
+    "import resource as _resource, signal as _signal\n"
+    "def _cpu_limit_exceeded(signum, frame):\n"
+    "    import resource\n"
+    "    # the kernel is signalled every second while over the soft limit, so lift it once\n"
+    "    resource.setrlimit(resource.RLIMIT_CPU, (resource.getrlimit(resource.RLIMIT_CPU)[1],) * 2)\n"
+    "    raise TimeoutError(" + repr(CPU_LIMIT_MESSAGE) + ")\n"
+    "_signal.signal(_signal.SIGXCPU, _cpu_limit_exceeded)\n"
+    "_usage = _resource.getrusage(_resource.RUSAGE_SELF)\n"
+    "_resource.setrlimit(_resource.RLIMIT_CPU, (int(_usage.ru_utime + _usage.ru_stime) + {cpu_limit}, "
+    "_resource.getrlimit(_resource.RLIMIT_CPU)[1]))\n"
+    "del _resource, _signal, _usage\n"
+)
+# lifts the soft limit again, so the idle kernel isn't signalled between cells
+KERNEL_CPU_UNLIMIT_CELL = (
+    "import resource as _resource\n"
+    "_resource.setrlimit(_resource.RLIMIT_CPU, (_resource.getrlimit(_resource.RLIMIT_CPU)[1],) * 2)\n"
+    "del _resource\n"
+)
+
+sandbox_image = SANDBOX_IMAGE
 
 code_execution_pool = None
+code_execution_pool_scaler = None
+conversation_kernels = None
+sandbox_executor = None
+sandbox_scheduler = None
+dependency_resolver = None
+package_cache = PackageCache()
+result_cache = None
+output_limiter = OutputLimiter()
+# install_python_libraries calls still running, per conversation
+installs_in_flight: defaultdict[str, set[Future]] = defaultdict(set)
+warm_start = False
+execution_timeout = 300.0
+cpu_time_limit = None
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name, "")
+    return int(value) if value.strip() else default
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name, "").strip().lower()
+    return value in ("1", "true", "yes") if value else default
+
+
+def _env_float(name: str, default: float | None) -> float | None:
+    value = os.getenv(name, "").strip()
+    if not value:
+        return default
+    # "0" or "none" disables the corresponding timeout
+    if value.lower() == "none" or float(value) <= 0:
+        return None
+    return float(value)
+
+
+class SandboxPoolScaler:
+    """
+    Keeps the pool's prewarm target in line with the observed queue depth of sandbox calls
+    and records how long each call waited to acquire a container.
+
+    The prewarm target (`PoolConfig.min_pool_size`) is raised to the number of in-flight plus
+    queued calls, bounded by the configured min/max pool size, so the prewarming thread spins up
+    containers ahead of demand. When demand drops the target falls back and containers that stay
+    idle longer than `idle_timeout` are reaped by the pool's health check loop.
+    """
+
+    def __init__(
+        self,
+        pool: ContainerPoolManager,
+        min_size: int,
+        max_size: int,
+        wait_samples: int = 1000,
+    ):
+        self.pool = pool
+        self.min_size = min_size
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._in_flight = 0
+        self._acquisitions = 0
+        self._wait_seconds: deque[float] = deque(maxlen=wait_samples)
+
+    def _rescale(self) -> None:
+        target = min(self.max_size, max(self.min_size, self._waiting + self._in_flight))
+        self.pool.config.min_pool_size = target
+
+    @contextmanager
+    def session(self, **kwargs) -> Iterator[SandboxSession]:
+        with self._lock:
+            self._waiting += 1
+            self._rescale()
+
+        start = time.perf_counter()
+        acquired = False
+        try:
+            with SandboxSession(pool=self.pool, **kwargs) as session:
+                with self._lock:
+                    self._waiting -= 1
+                    self._in_flight += 1
+                    self._acquisitions += 1
+                    self._wait_seconds.append(time.perf_counter() - start)
+                acquired = True
+                yield session
+        finally:
+            with self._lock:
+                if acquired:
+                    self._in_flight -= 1
+                else:
+                    self._waiting -= 1
+                self._rescale()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            waits = list(self._wait_seconds)
+            stats = {
+                "queue_depth": self._waiting,
+                "in_flight": self._in_flight,
+                "prewarm_target": self.pool.config.min_pool_size,
+                "acquisitions": self._acquisitions,
+            }
+
+        if waits:
+            stats["acquire_wait_seconds"] = summarize_durations(waits)
+        stats["pool"] = self.pool.get_stats()
+
+        return stats
+
+
+def start_warm_start_server(container) -> None:
+    """(Re)start the image's warm-start fork server in `container`, detached; images without it are left alone."""
+    container.exec_run(
+        ["/bin/sh", "-c", f"[ -f {WARM_START_SCRIPT} ] && exec python {WARM_START_SCRIPT} restart"],
+        detach=True,
+    )
+
+
+def restart_warm_start_server(session) -> None:
+    """Restart the fork server after an install, so forked runs don't keep the old preloaded packages."""
+    if warm_start and not isinstance(session, InteractiveSandboxSession):
+        start_warm_start_server(session.container)
+
+
+class WarmStartDockerPoolManager(DockerPoolManager):
+    """Docker pool whose containers start preloading the warm-start fork server as soon as they are created."""
+
+    def _create_container(self) -> PooledContainer:
+        container = super()._create_container()
+        try:
+            start_warm_start_server(container.container)
+        except Exception:  # noqa: BLE001
+            # runs fall back to a cold interpreter and start the server themselves
+            self.logger.exception("Failed to start warm-start server")
+        return container
+
+
+@dataclass
+class CodeExecutionContext:
+    pool: ContainerPoolManager
+    # conversation the run belongs to, used to pick its persistent kernel
+    conversation_id: str | None = None
+    # receives stdout of running code incrementally; called on the event loop thread
+    stdout_callback: Callable[[str], None] | None = None
+    # tenant the conversation belongs to, for fair scheduling of sandbox work
+    tenant: str = "default"
+    # per-phase timings of the turn in progress
+    timings: TurnTimings | None = None
+
+
+@contextmanager
+def sandbox_session(pool: ContainerPoolManager, **kwargs) -> Iterator[SandboxSession]:
+    """Open a pooled sandbox session, going through the pool scaler when one manages `pool`."""
+    if code_execution_pool_scaler is not None and code_execution_pool_scaler.pool is pool:
+        with code_execution_pool_scaler.session(**kwargs) as session:
+            yield session
+    else:
+        with SandboxSession(pool=pool, **kwargs) as session:
+            yield session
+
+
+@contextmanager
+def code_execution_session(context: CodeExecutionContext, **kwargs) -> Iterator:
+    """
+    Open the session code should run in: the conversation's persistent kernel when stateful
+    kernels are enabled, otherwise a fresh session on a pooled container.
+    """
+    start = time.perf_counter()
+    if conversation_kernels is not None and context.conversation_id:
+        with conversation_kernels.session(context.conversation_id) as session:
+            record_latency("container_acquire", time.perf_counter() - start, context.timings)
+            yield session
+    else:
+        with sandbox_session(context.pool, **kwargs) as session:
+            record_latency("container_acquire", time.perf_counter() - start, context.timings)
+            yield session
+
+
+def exec_streaming(
+    session,
+    command: str,
+    on_output: Callable[[str], None] | None = None,
+    control: RunControl | None = None,
+    workdir: str = "/sandbox",
+) -> ConsoleOutput:
+    """
+    Run `command` in the session's Docker container, passing stdout to `on_output` as it is
+    produced. If `control` times out or is cancelled the whole container is killed.
+    """
+    container = session.container
+    api = container.client.api
+    exec_id = api.exec_create(container.id, command, stdout=True, stderr=True, workdir=workdir)["Id"]
+
+    if control is not None:
+        control.watch(container.kill)
+
+    stdout_decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    stderr_decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    stdout, stderr = [], []
+    try:
+        for stdout_chunk, stderr_chunk in api.exec_start(exec_id, stream=True, demux=True):
+            if stdout_chunk and (text := stdout_decoder.decode(stdout_chunk)):
+                stdout.append(text)
+                if on_output is not None:
+                    on_output(text)
+            if stderr_chunk:
+                stderr.append(stderr_decoder.decode(stderr_chunk))
+    except Exception:
+        # the stream breaks when the container is killed; the partial output is still useful
+        if control is None or not control.killed:
+            raise
+    finally:
+        if control is not None:
+            control.finish()
+
+    exit_code = 137 if control is not None and control.killed else api.exec_inspect(exec_id)["ExitCode"]
+    return ConsoleOutput(
+        exit_code=exit_code or 0,
+        stdout="".join(stdout) + stdout_decoder.decode(b"", final=True),
+        stderr="".join(stderr) + stderr_decoder.decode(b"", final=True),
+    )
+
+
+def run_code(
+    session,
+    code: str,
+    on_output: Callable[[str], None] | None = None,
+    control: RunControl | None = None,
+    cpu_limit: int | None = None,
+) -> ConsoleOutput:
+    """
+    Run `code` in `session`. On pooled containers with warm start enabled the code is handed
+    to the image's fork server, which already has the heavy libraries imported. When
+    `on_output` is given, stdout is passed to it incrementally while the code runs.
+
+    `control` bounds the wall-clock time and lets the run be cancelled; `cpu_limit` bounds the
+    CPU seconds the code may use. When either stops a kernel cell, the kernel's container is
+    killed and the caller has to recycle the kernel with `recycle_session`.
+    """
+    if isinstance(session, InteractiveSandboxSession):
+        if cpu_limit:
+            # the kernel's CPU time adds up over all its cells, so each cell's budget starts from what was used so far
+            session.run(KERNEL_CPU_LIMIT_CELL.format(cpu_limit=cpu_limit))
+        if control is not None:
+            control.watch(session.container.kill)
+        try:
+            # the kernel only reports output once the cell finishes
+            result = session.run(code, timeout=control.timeout if control is not None else None)
+        except Exception:
+            if control is None or not control.killed:
+                raise
+            result = ConsoleOutput(exit_code=137, stdout="", stderr="")
+        finally:
+            if control is not None:
+                control.finish()
+        if cpu_limit and not (control is not None and control.killed):
+            session.run(KERNEL_CPU_UNLIMIT_CELL)
+        if on_output is not None and result.stdout:
+            on_output(result.stdout)
+        return result
+
+    with tempfile.NamedTemporaryFile("w", suffix=".py", delete=False, encoding="utf-8") as code_file:
+        code_file.write(code)
+        local_path = code_file.name
+
+    remote_path = f"/sandbox/{uuid.uuid4().hex}.py"
+    try:
+        session.copy_to_runtime(local_path, remote_path)
+    finally:
+        os.unlink(local_path)
+
+    cold_command = f"python -u {shlex.quote(remote_path)}"
+    if cpu_limit:
+        cold_command = f"ulimit -t {cpu_limit}; exec {cold_command}"
+    if warm_start:
+        cpu_limit_arg = f"--cpu-limit {cpu_limit} " if cpu_limit else ""
+        warm_command = f"python {WARM_START_SCRIPT} run {cpu_limit_arg}{shlex.quote(remote_path)}"
+        # images built before the fork server was added don't have the script, run those cold
+        script = f"if [ -f {WARM_START_SCRIPT} ]; then exec {warm_command}; else {cold_command}; fi"
+        command = f"/bin/sh -c {shlex.quote(script)}"
+    elif cpu_limit:
+        command = f"/bin/sh -c {shlex.quote(cold_command)}"
+    else:
+        command = cold_command
+
+    return exec_streaming(session, command, on_output=on_output, control=control)
+
+
+def describe_cpu_limit(result: ConsoleOutput, cpu_limit: int | None) -> str | None:
+    """Explain a run that `cpu_limit` stopped, or None when it didn't."""
+    if not cpu_limit:
+        return None
+    # SIGXCPU at the soft limit (152), SIGKILL at the hard one (137), or the kernel's handler
+    if result.exit_code == 152 or CPU_LIMIT_MESSAGE in (result.stderr or ""):
+        return f"Execution exceeded its CPU time limit of {cpu_limit} seconds."
+    if result.exit_code == 137:
+        return f"Execution was killed, likely for going over its CPU time limit of {cpu_limit} seconds or its memory limit."
+    return None
+
+
+def discard_pooled_container(session) -> None:
+    """Remove the session's container from its pool instead of returning it, e.g. after it was killed."""
+    pooled_container = getattr(session, "_pooled_container", None)
+    pool = getattr(session, "_pool_manager", None)
+    if pooled_container is None or pool is None:
+        return
+
+    # mirrors ContainerPoolManager.release() for expired containers
+    with pool._condition:
+        pool._destroy_container(pooled_container)
+        if not pool._closed:
+            pool._ensure_min_pool_size()
+    session._pooled_container = None
+
+
+def get_artifact_path(name: str) -> Path | None:
+    """Path of a spilled output artifact by file name, or None when there is no such artifact."""
+    return output_limiter.resolve(name)
+
+
+def recycle_session(session, conversation_id: str | None) -> None:
+    """Throw away the container a run was killed in: the conversation's kernel, or the pooled container."""
+    if isinstance(session, InteractiveSandboxSession):
+        if conversation_kernels is not None and conversation_id:
+            conversation_kernels.recycle(conversation_id, session)
+    else:
+        discard_pooled_container(session)
+
+
+def close_conversation_kernel(conversation_id: str) -> None:
+    """Close a deleted conversation's kernel and forget the libraries it installed."""
+    if conversation_kernels is not None:
+        conversation_kernels.close(conversation_id)
+    package_cache.forget(conversation_id)
+
+
+def close_conversation_kernels() -> None:
+    if conversation_kernels is not None:
+        conversation_kernels.close_all()
+
+
+@asynccontextmanager
+async def sandbox_slot(context: CodeExecutionContext):
+    """Wait for the sandbox scheduler to admit this conversation's call, if scheduling is enabled."""
+    if sandbox_scheduler is None:
+        yield
+        return
+    async with sandbox_scheduler.slot(context.tenant, context.conversation_id or "default"):
+        yield
+
+
+@contextmanager
+def tracking_install(conversation_id: str | None) -> Iterator[None]:
+    """Mark an install as in flight for the conversation until the block exits."""
+    key = conversation_id or "default"
+    done = Future()
+    installs_in_flight[key].add(done)
+    try:
+        yield
+    finally:
+        installs_in_flight[key].discard(done)
+        if not installs_in_flight[key]:
+            del installs_in_flight[key]
+        done.set_result(None)
+
+
+async def wait_for_installs(conversation_id: str | None) -> None:
+    """
+    Wait for installs the conversation started earlier, so code issued in parallel with them
+    runs on a container where those libraries are restored.
+    """
+    if pending := installs_in_flight.get(conversation_id or "default"):
+        await asyncio.wait([asyncio.wrap_future(done) for done in pending])
+
+
+def preinstall_dependencies(session, code: str, conversation_id: str | None) -> list[str]:
+    """Install allowlisted libraries `code` imports but the container lacks; returns what was installed."""
+    if dependency_resolver is None:
+        return []
+    missing = dependency_resolver.missing_requirements(session, code)
+    if not missing:
+        return []
+    requirements = list(missing.values())
+    if package_cache.install(session, requirements)["exit_code"] != 0:
+        # let the run fail on the import as usual, the model can still install by hand
+        return []
+    package_cache.remember(conversation_id, requirements)
+    return requirements
+
+
+def get_sandbox_executor() -> SandboxExecutor:
+    global sandbox_executor
+
+    if sandbox_executor is None:
+        sandbox_executor = SandboxExecutor(
+            max_workers=_env_int("SANDBOX_EXECUTOR_MAX_WORKERS", 8),
+            max_queue=_env_int("SANDBOX_EXECUTOR_MAX_QUEUE", 32),
+        )
+
+    return sandbox_executor
+
+
+def get_code_execution_pool_stats() -> dict:
+    stats = {}
+    if code_execution_pool_scaler is not None:
+        stats.update(code_execution_pool_scaler.get_stats())
+    if sandbox_executor is not None:
+        stats["executor"] = sandbox_executor.get_stats()
+    if result_cache is not None:
+        stats["result_cache"] = result_cache.get_stats()
+    if sandbox_scheduler is not None:
+        stats["scheduler"] = sandbox_scheduler.get_stats()
+    return stats
+
 
 def init_code_execution_pool() -> ContainerPoolManager:
-    global code_execution_pool
+    global code_execution_pool, code_execution_pool_scaler, conversation_kernels, package_cache, result_cache, output_limiter, warm_start
+    global execution_timeout, cpu_time_limit, sandbox_scheduler, dependency_resolver, sandbox_image
 
     if code_execution_pool is not None:
         return code_execution_pool
 
-    image = "chihyuyeh/python-data-analytics:0.0.1"
+    image = sandbox_image = os.getenv("SANDBOX_IMAGE", "").strip() or SANDBOX_IMAGE
     # default libraries to install
     libraries = []
     skip_environment_setup = True
 
-    code_execution_pool = create_pool_manager(
-        backend="docker",
+    # uses the fork server of images built from the current Dockerfile, older images run code cold
+    warm_start = _env_bool("SANDBOX_WARM_START", False)
+
+    # host directory mounted read-only into the sandboxes as a shared wheelhouse for installed libraries
+    package_cache = PackageCache(
+        os.getenv("SANDBOX_WHEEL_CACHE_DIR", "").strip() or None,
+        builder_image=image,
+        on_install=restart_warm_start_server,
+    )
+
+    max_pool_size = _env_int("SANDBOX_POOL_MAX_SIZE", 1)
+    min_pool_size = min(_env_int("SANDBOX_POOL_MIN_SIZE", 1), max_pool_size)
+
+    pool_manager_class = WarmStartDockerPoolManager if warm_start else DockerPoolManager
+    code_execution_pool = pool_manager_class(
         config=PoolConfig(
-            max_pool_size=1,
-            min_pool_size=1,
+            max_pool_size=max_pool_size,
+            min_pool_size=min_pool_size,
             enable_prewarming=True,
+            idle_timeout=_env_float("SANDBOX_POOL_IDLE_TIMEOUT", 300.0),
+            acquisition_timeout=_env_float("SANDBOX_POOL_ACQUISITION_TIMEOUT", 30.0),
+            max_container_lifetime=_env_float("SANDBOX_POOL_MAX_CONTAINER_LIFETIME", 3600.0),
         ),
         lang="python",
         skip_environment_setup=skip_environment_setup,
         image=image,
+        runtime_configs=package_cache.runtime_configs,
         verbose=True,
     )
+    code_execution_pool_scaler = SandboxPoolScaler(
+        code_execution_pool,
+        min_size=min_pool_size,
+        max_size=max_pool_size,
+    )
+
+    # fair admission of sandbox work across tenants and conversations
+    sandbox_scheduler = FairScheduler(
+        capacity=_env_int("SCHEDULER_SANDBOX_CAPACITY", max_pool_size),
+        tenant_limit=_env_int("SCHEDULER_TENANT_LIMIT", 0) or None,
+        # tool calls of one model response run concurrently, each on its own pooled container
+        conversation_limit=_env_int("SANDBOX_MAX_PARALLEL_CALLS", 4) or None,
+        weights=parse_weights(os.getenv("SCHEDULER_TENANT_WEIGHTS", "")),
+    )
+
+    # allowlisted libraries imported by submitted code are installed before it runs
+    if _env_bool("SANDBOX_AUTO_INSTALL", True):
+        dependency_resolver = DependencyResolver({
+            **DEFAULT_AUTO_INSTALL,
+            **parse_allowlist(os.getenv("SANDBOX_AUTO_INSTALL_ALLOWLIST", "")),
+        })
+
+    # per-call limits for execute_python_code; a run that exceeds them is killed and its container recycled
+    execution_timeout = _env_float("SANDBOX_EXECUTION_TIMEOUT", 300.0)
+    cpu_time_limit = _env_int("SANDBOX_CPU_TIME_LIMIT", 0) or None
+
+    # caps on stdout/stderr returned to the model; the full text is spilled to an artifact file
+    output_limiter = OutputLimiter(
+        max_bytes=_env_int("SANDBOX_OUTPUT_MAX_BYTES", 20000),
+        max_lines=_env_int("SANDBOX_OUTPUT_MAX_LINES", 200),
+        artifact_dir=os.getenv("SANDBOX_ARTIFACT_DIR", "artifacts"),
+        max_artifacts=_env_int("SANDBOX_ARTIFACT_MAX_FILES", 1000),
+        max_artifact_bytes=_env_int("SANDBOX_ARTIFACT_MAX_BYTES", 512 * 1024 * 1024),
+    )
+
+    # opt-in cache of results for byte-identical code; a size of 0 disables it
+    if (result_cache_size := _env_int("SANDBOX_RESULT_CACHE_SIZE", 0)) > 0:
+        result_cache = ResultCache(
+            max_entries=result_cache_size,
+            ttl=_env_float("SANDBOX_RESULT_CACHE_TTL", 600.0),
+        )
+
+    if _env_bool("SANDBOX_STATEFUL_KERNEL", False):
+        conversation_kernels = ConversationKernels(
+            image=image,
+            idle_timeout=_env_float("SANDBOX_KERNEL_IDLE_TIMEOUT", 1800.0),
+            max_kernels=_env_int("SANDBOX_KERNEL_MAX_KERNELS", 16),
+            max_memory=os.getenv("SANDBOX_KERNEL_MAX_MEMORY", "").strip() or "1g",
+            reap_interval=_env_float("SANDBOX_KERNEL_REAP_INTERVAL", 60.0) or 60.0,
+            runtime_configs=package_cache.runtime_configs,
+            verbose=True,
+        )
 
     if len(libraries) > 0 and not skip_environment_setup:
-        with SandboxSession(pool=code_execution_pool, verbose=True) as session:
+        with sandbox_session(code_execution_pool, verbose=True) as session:
             session.execute_command(f'pip install {" ".join(libraries)}')
 
     return code_execution_pool
 
 
-@dataclass
-class CodeExecutionContext:
-    pool: ContainerPoolManager
-
-
 @function_tool
 async def execute_python_code(
     ctx: RunContextWrapper[CodeExecutionContext],
     code: str,
+    deterministic: bool = True,
 ) -> dict:
     """
     Give a python code to execute in a sandboxed environment and get the result.
 
     Args:
         code: The python code to execute. Type: str
+        deterministic: Set to False when the code's output can change between runs (randomness, current time, network access, files that may change), so a cached result is never reused. Type: bool
 
     Returns:
         A dictionary containing the result of the code execution.
@@ -61,18 +592,59 @@ async def execute_python_code(
         - error: The error message if the code execution failed, None otherwise.
         - stdout: The stdout of the code execution.
         - stderr: The stderr of the code execution.
+        - truncated: Present when stdout/stderr were too long; the head and tail are kept and this describes what was dropped.
+        - installed: Present when libraries imported by the code were missing and got installed before running it.
     """
+    def _cache_key(code: str) -> str | None:
+        # kernel state makes results depend on earlier cells, so only stateless runs are cached
+        if (
+            result_cache is None
+            or not deterministic
+            or not is_probably_deterministic(code)
+            or (conversation_kernels is not None and ctx.context.conversation_id)
+        ):
+            return None
+        requirement_sets = package_cache.requirement_sets(ctx.context.conversation_id)
+        return result_key(code, sandbox_image, repr(requirement_sets))
+
+    control = RunControl(timeout=execution_timeout)
+
+    timings = ctx.context.timings
+
     def _run(code: str) -> dict:
+        record_latency("sandbox_queue", time.perf_counter() - queued_at, timings)
         try:
-            with SandboxSession(pool=ctx.context.pool, verbose=True) as session:
-                result = session.run(code)
+            with code_execution_session(ctx.context, verbose=True) as session:
+                with timed("package_setup", timings):
+                    # pooled containers may not have what this conversation installed earlier
+                    package_cache.restore(session, ctx.context.conversation_id)
+                    installed = preinstall_dependencies(session, code, ctx.context.conversation_id)
+                with timed("code_run", timings):
+                    try:
+                        result = run_code(
+                            session,
+                            code,
+                            on_output=on_output,
+                            control=control,
+                            cpu_limit=cpu_time_limit,
+                        )
+                    except Exception:
+                        # a kernel that died mid-cell, e.g. over its CPU limit, can't run the next one
+                        if isinstance(session, InteractiveSandboxSession):
+                            recycle_session(session, ctx.context.conversation_id)
+                        raise
+                if control.killed:
+                    recycle_session(session, ctx.context.conversation_id)
 
-                return {
+                output = {
                     "success": result.exit_code == 0,
-                    "error": None,
+                    "error": control.describe() if control.killed else describe_cpu_limit(result, cpu_time_limit),
                     "stdout": result.stdout,
                     "stderr": result.stderr,
                 }
+                if installed:
+                    output["installed"] = installed
+                return output_limiter.apply(output)
         except Exception as e:  # noqa: BLE001
             return {
                 "success": False,
@@ -81,8 +653,32 @@ async def execute_python_code(
                 "stderr": None,
             }
 
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, _run, code)
+    on_output = None
+    if (stdout_callback := ctx.context.stdout_callback) is not None:
+        loop = asyncio.get_running_loop()
+
+        def on_output(text: str) -> None:
+            loop.call_soon_threadsafe(stdout_callback, text)
+
+    cache_key = _cache_key(code)
+    if cache_key is not None and (cached := result_cache.get(cache_key)) is not None:
+        if on_output is not None and cached["stdout"]:
+            on_output(cached["stdout"])
+        return cached
+
+    await wait_for_installs(ctx.context.conversation_id)
+    queued_at = time.perf_counter()
+    try:
+        async with sandbox_slot(ctx.context):
+            result = await get_sandbox_executor().run(_run, code)
+    except asyncio.CancelledError:
+        # stop the run inside the sandbox too, not just the await
+        control.cancel()
+        raise
+    if cache_key is not None and result["success"]:
+        result_cache.put(cache_key, result)
+
+    return result
 
 
 @function_tool
@@ -103,14 +699,18 @@ async def install_python_libraries(
         - stderr: The stderr of the library installation if the library installation failed, None otherwise.
     """
     def _install(libraries: list[str]) -> dict:
+        record_latency("sandbox_queue", time.perf_counter() - queued_at, ctx.context.timings)
         try:
-            with SandboxSession(pool=ctx.context.pool, verbose=True) as session:
-                result = session.execute_command(f'pip install {" ".join(libraries)}')
+            with code_execution_session(ctx.context, verbose=True) as session:
+                with timed("pip_install", ctx.context.timings):
+                    result = package_cache.install(session, libraries)
+                if result["exit_code"] == 0:
+                    package_cache.remember(ctx.context.conversation_id, libraries)
 
                 return {
-                    "success": result.exit_code == 0,
+                    "success": result["exit_code"] == 0,
                     "error": None,
-                    "stderr": result.stderr if result.exit_code != 0 else None,
+                    "stderr": result["stderr"] if result["exit_code"] != 0 else None,
                 }
         except Exception as e:  # noqa: BLE001
             return {
@@ -119,5 +719,7 @@ async def install_python_libraries(
                 "stderr": None,
             }
 
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, _install, libraries)
+    queued_at = time.perf_counter()
+    with tracking_install(ctx.context.conversation_id):
+        async with sandbox_slot(ctx.context):
+            return await get_sandbox_executor().run(_install, libraries)
@@ -0,0 +1,110 @@
+import ast
+import shlex
+import threading
+from collections import OrderedDict
+
+from tools.package_cache import container_id_of
+
+# import name -> pip requirement for libraries code may use without installing them first
+DEFAULT_AUTO_INSTALL = {
+    "bs4": "beautifulsoup4",
+    "cv2": "opencv-python-headless",
+    "dateutil": "python-dateutil",
+    "geopandas": "geopandas",
+    "lightgbm": "lightgbm",
+    "matplotlib": "matplotlib",
+    "networkx": "networkx",
+    "numpy": "numpy",
+    "openpyxl": "openpyxl",
+    "pandas": "pandas",
+    "PIL": "pillow",
+    "plotly": "plotly",
+    "polars": "polars",
+    "pyarrow": "pyarrow",
+    "requests": "requests",
+    "scipy": "scipy",
+    "seaborn": "seaborn",
+    "shapely": "shapely",
+    "sklearn": "scikit-learn",
+    "statsmodels": "statsmodels",
+    "sympy": "sympy",
+    "tabulate": "tabulate",
+    "tqdm": "tqdm",
+    "xgboost": "xgboost",
+    "yaml": "pyyaml",
+}
+
+_FIND_MISSING = (
+    "import importlib.util, sys; "
+    "print(' '.join(name for name in sys.argv[1:] if importlib.util.find_spec(name) is None))"
+)
+
+
+def parse_allowlist(value: str) -> dict[str, str]:
+    """Parse `module=requirement` or bare `name` items (import name == requirement) into a dict."""
+    allowlist = {}
+    for item in value.split(","):
+        module, _, requirement = item.strip().partition("=")
+        if module:
+            allowlist[module] = requirement or module
+    return allowlist
+
+
+def imported_modules(code: str) -> set[str]:
+    """Top-level names of the absolute imports in `code`; empty if it doesn't parse."""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return set()
+
+    modules = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            modules.add(node.module.split(".")[0])
+    return modules
+
+
+class DependencyResolver:
+    """
+    Installs allowlisted libraries that code imports but its container lacks, before the code
+    runs, so a missing import doesn't cost a failed run and an extra model round-trip.
+
+    Modules found present are remembered per container, so the check usually costs nothing
+    after the first run on a container.
+    """
+
+    def __init__(self, allowlist: dict[str, str], max_containers: int = 1024):
+        self.allowlist = allowlist
+        self.max_containers = max_containers
+        self._lock = threading.Lock()
+        self._present: OrderedDict[str, set[str]] = OrderedDict()
+
+    def _known_present(self, container_id: str | None) -> set[str]:
+        with self._lock:
+            return set(self._present.get(container_id, ())) if container_id is not None else set()
+
+    def _mark_present(self, container_id: str | None, modules: set[str]) -> None:
+        if container_id is None:
+            return
+        with self._lock:
+            self._present.setdefault(container_id, set()).update(modules)
+            self._present.move_to_end(container_id)
+            while len(self._present) > self.max_containers:
+                self._present.popitem(last=False)
+
+    def missing_requirements(self, session, code: str) -> dict[str, str]:
+        """Allowlisted modules imported by `code` that the session's container can't import."""
+        container_id = container_id_of(session)
+        candidates = (imported_modules(code) & self.allowlist.keys()) - self._known_present(container_id)
+        if not candidates:
+            return {}
+
+        names = " ".join(shlex.quote(name) for name in sorted(candidates))
+        result = session.execute_command(f"python -c {shlex.quote(_FIND_MISSING)} {names}")
+        if result.exit_code != 0:
+            return {}
+        missing = set(result.stdout.split()) & candidates
+        self._mark_present(container_id, candidates - missing)
+        return {module: self.allowlist[module] for module in sorted(missing)}
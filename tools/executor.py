@@ -0,0 +1,102 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any
+
+from tools.metrics import summarize_durations
+
+
+class SandboxExecutor:
+    """
+    Dedicated, bounded thread pool for blocking sandbox calls.
+
+    At most `max_workers` calls run at once and at most `max_queue` more are queued behind
+    them; further callers wait (without blocking the event loop) until a slot frees up, so a
+    burst of long-running code cells cannot pile unbounded work onto the process. Waiting is
+    done on thread-safe futures, so one executor can serve several event loops.
+    """
+
+    def __init__(self, max_workers: int = 8, max_queue: int = 32, wait_samples: int = 1000):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sandbox")
+        self._lock = threading.Lock()
+        self._admitted = 0
+        self._running = 0
+        self._completed = 0
+        self._waiters: deque[Future] = deque()
+        self._queue_seconds: deque[float] = deque(maxlen=wait_samples)
+
+    def _grant_next(self) -> None:
+        """Hand free slots to waiting callers (must hold lock)."""
+        while self._waiters and self._admitted < self.max_workers + self.max_queue:
+            waiter = self._waiters.popleft()
+            if waiter.set_running_or_notify_cancel():
+                self._admitted += 1
+                waiter.set_result(None)
+
+    async def _admit(self) -> None:
+        with self._lock:
+            if not self._waiters and self._admitted < self.max_workers + self.max_queue:
+                self._admitted += 1
+                return
+            waiter = Future()
+            self._waiters.append(waiter)
+
+        try:
+            await asyncio.wrap_future(waiter)
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter.done() and not waiter.cancelled():
+                    # the slot was granted just before the cancellation landed, pass it on
+                    self._admitted -= 1
+                    self._grant_next()
+            raise
+
+    def _release(self) -> None:
+        with self._lock:
+            self._admitted -= 1
+            self._completed += 1
+            self._grant_next()
+
+    def _call(self, submitted_at: float, fn: Callable[..., Any], *args: Any) -> Any:
+        with self._lock:
+            self._running += 1
+            self._queue_seconds.append(time.perf_counter() - submitted_at)
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run `fn(*args)` on the sandbox threads and await its result."""
+        submitted_at = time.perf_counter()
+        await self._admit()
+
+        future = self._executor.submit(self._call, submitted_at, fn, *args)
+        future.add_done_callback(lambda _: self._release())
+        return await asyncio.wrap_future(future)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            queue_seconds = list(self._queue_seconds)
+            stats = {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queued": self._admitted - self._running,
+                "waiting_for_admission": len(self._waiters),
+                "completed": self._completed,
+            }
+
+        if queue_seconds:
+            stats["queue_wait_seconds"] = summarize_durations(queue_seconds)
+
+        return stats
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
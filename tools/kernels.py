@@ -0,0 +1,190 @@
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+from llm_sandbox import InteractiveSandboxSession
+
+
+@dataclass
+class ConversationKernel:
+    session: InteractiveSandboxSession | None = None
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    last_used_at: float = field(default_factory=time.monotonic)
+    # set once the kernel was evicted or reaped; a caller that still holds it must look it up again
+    closed: bool = False
+
+
+class ConversationKernels:
+    """
+    Persistent IPython kernels, one per conversation.
+
+    Each conversation gets its own sandbox container running an interactive kernel, so
+    variables, imports and loaded data survive between tool calls. Kernels are opened lazily
+    on first use and closed by a background reaper once they have been idle for longer than
+    `idle_timeout` seconds. At most `max_kernels` exist at a time: opening one more evicts the
+    least recently used idle kernel, whose conversation starts over with a fresh kernel.
+    """
+
+    def __init__(
+        self,
+        image: str,
+        idle_timeout: float | None = 1800.0,
+        max_kernels: int = 16,
+        max_memory: str | None = "1g",
+        reap_interval: float = 60.0,
+        runtime_configs: dict | None = None,
+        verbose: bool = False,
+    ):
+        self.image = image
+        self.runtime_configs = runtime_configs
+        self.idle_timeout = idle_timeout
+        self.max_kernels = max_kernels
+        self.max_memory = max_memory
+        self.verbose = verbose
+        self._kernels: OrderedDict[str, ConversationKernel] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._reaper = None
+        if idle_timeout is not None:
+            self._reaper = threading.Thread(
+                target=self._reap,
+                args=(reap_interval,),
+                name="kernel-reaper",
+                daemon=True,
+            )
+            self._reaper.start()
+
+    def _open_session(self) -> InteractiveSandboxSession:
+        session = InteractiveSandboxSession(
+            lang="python",
+            image=self.image,
+            skip_environment_setup=True,
+            max_memory=self.max_memory,
+            runtime_configs=self.runtime_configs,
+            verbose=self.verbose,
+        )
+        session.open()
+        return session
+
+    def _close_kernel(self, kernel: ConversationKernel) -> None:
+        if kernel.session is None:
+            return
+        try:
+            kernel.session.close()
+        except Exception:  # noqa: BLE001
+            pass
+        kernel.session = None
+
+    def _take_unused(self, conversation_ids: list[str], limit: int | None = None) -> list[ConversationKernel]:
+        """
+        Remove up to `limit` of the given kernels that nobody is using, marked closed and still
+        locked for `_release`; called under `_lock`.
+        """
+        taken = []
+        for conversation_id in conversation_ids:
+            if limit is not None and len(taken) >= limit:
+                break
+            kernel = self._kernels[conversation_id]
+            if not kernel.lock.acquire(blocking=False):
+                continue
+            kernel.closed = True
+            del self._kernels[conversation_id]
+            taken.append(kernel)
+        return taken
+
+    def _release(self, kernels: list[ConversationKernel]) -> None:
+        for kernel in kernels:
+            try:
+                self._close_kernel(kernel)
+            finally:
+                kernel.lock.release()
+
+    def _reap(self, interval: float) -> None:
+        while not self._stopped.wait(interval):
+            self.close_idle()
+
+    def close_idle(self) -> None:
+        if self.idle_timeout is None:
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            kernels = self._take_unused([
+                conversation_id
+                for conversation_id, kernel in self._kernels.items()
+                if now - kernel.last_used_at > self.idle_timeout
+            ])
+        self._release(kernels)
+
+    def _acquire(self, conversation_id: str) -> ConversationKernel:
+        """Look up or add the conversation's kernel and lock it, evicting idle kernels over the bound."""
+        while True:
+            evicted = []
+            with self._lock:
+                kernel = self._kernels.get(conversation_id)
+                if kernel is None:
+                    kernel = ConversationKernel()
+                    self._kernels[conversation_id] = kernel
+                    if (over := len(self._kernels) - self.max_kernels) > 0:
+                        # least recently used first; the new kernel is last
+                        unused = [
+                            other_id
+                            for other_id, other in list(self._kernels.items())[:-1]
+                            if not other.lock.locked()
+                        ]
+                        if len(unused) < over:
+                            del self._kernels[conversation_id]
+                            raise RuntimeError(f"all {self.max_kernels} conversation kernels are busy, try again later")
+                        evicted = self._take_unused(unused, limit=over)
+                self._kernels.move_to_end(conversation_id)
+            self._release(evicted)
+
+            # the container is started under the kernel's own lock so other conversations aren't blocked
+            kernel.lock.acquire()
+            if not kernel.closed:
+                return kernel
+            kernel.lock.release()
+
+    @contextmanager
+    def session(self, conversation_id: str) -> Iterator[InteractiveSandboxSession]:
+        """Yield the conversation's kernel session, holding it exclusively for the duration."""
+        kernel = self._acquire(conversation_id)
+        try:
+            if kernel.session is None:
+                kernel.session = self._open_session()
+            yield kernel.session
+        finally:
+            kernel.last_used_at = time.monotonic()
+            kernel.lock.release()
+
+    def recycle(self, conversation_id: str, session: InteractiveSandboxSession) -> None:
+        """
+        Drop the conversation's kernel while the caller still holds it, e.g. after its cell was
+        killed; the conversation's next call opens a fresh kernel.
+        """
+        with self._lock:
+            kernel = self._kernels.get(conversation_id)
+            if kernel is None or kernel.session is not session:
+                return
+            kernel.closed = True
+            del self._kernels[conversation_id]
+        self._close_kernel(kernel)
+
+    def close(self, conversation_id: str) -> None:
+        with self._lock:
+            kernel = self._kernels.pop(conversation_id, None)
+        if kernel is not None:
+            kernel.closed = True
+            self._close_kernel(kernel)
+
+    def close_all(self) -> None:
+        self._stopped.set()
+        with self._lock:
+            kernels = list(self._kernels.values())
+            self._kernels.clear()
+        for kernel in kernels:
+            kernel.closed = True
+            self._close_kernel(kernel)
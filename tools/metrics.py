@@ -0,0 +1,117 @@
+import bisect
+import statistics
+import threading
+import time
+from collections import deque
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+
+# upper bounds (seconds) of the latency histogram buckets, Prometheus style
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def summarize_durations(samples: Iterable[float]) -> dict:
+    """Summarize duration samples (seconds) as mean/p50/p95/p99/max; empty dict when there are none."""
+    values = sorted(samples)
+    if not values:
+        return {}
+
+    return {
+        "mean": statistics.fmean(values),
+        "p50": values[int(0.50 * (len(values) - 1))],
+        "p95": values[int(0.95 * (len(values) - 1))],
+        "p99": values[int(0.99 * (len(values) - 1))],
+        "max": values[-1],
+    }
+
+
+class LatencyHistogram:
+    """Cumulative bucket counts of durations, plus recent samples for percentiles."""
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS, samples: int = 1000):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._samples: deque[float] = deque(maxlen=samples)
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self._samples.append(seconds)
+
+    def snapshot(self) -> dict:
+        cumulative, buckets = 0, {}
+        for bound, count in zip((*self.buckets, float("inf")), self.counts):
+            cumulative += count
+            buckets["+Inf" if bound == float("inf") else str(bound)] = cumulative
+        return {"count": self.count, "sum": self.sum, "buckets": buckets, **summarize_durations(self._samples)}
+
+
+class LatencyRecorder:
+    """Process-wide latency histograms, one per phase (model call, sandbox queue, code run, ...)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: dict[str, LatencyHistogram] = {}
+
+    def observe(self, phase: str, seconds: float) -> None:
+        with self._lock:
+            if phase not in self._histograms:
+                self._histograms[phase] = LatencyHistogram()
+            self._histograms[phase].observe(seconds)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {phase: histogram.snapshot() for phase, histogram in sorted(self._histograms.items())}
+
+    def prometheus(self, name: str = "code_agent_phase_seconds") -> str:
+        """The histograms in Prometheus text exposition format."""
+        lines = [f"# HELP {name} Time spent per phase of an agent turn.", f"# TYPE {name} histogram"]
+        for phase, snapshot in self.get_stats().items():
+            for bound, count in snapshot["buckets"].items():
+                lines.append(f'{name}_bucket{{phase="{phase}",le="{bound}"}} {count}')
+            lines.append(f'{name}_sum{{phase="{phase}"}} {snapshot["sum"]}')
+            lines.append(f'{name}_count{{phase="{phase}"}} {snapshot["count"]}')
+        return "\n".join(lines) + "\n"
+
+
+class TurnTimings:
+    """Time spent per phase during one agent turn; phases can be recorded from any thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seconds: dict[str, float] = {}
+        self._counts: dict[str, int] = {}
+
+    def add(self, phase: str, seconds: float) -> None:
+        with self._lock:
+            self._seconds[phase] = self._seconds.get(phase, 0.0) + seconds
+            self._counts[phase] = self._counts.get(phase, 0) + 1
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                phase: {"seconds": round(seconds, 4), "count": self._counts[phase]}
+                for phase, seconds in self._seconds.items()
+            }
+
+
+latency_recorder = LatencyRecorder()
+
+
+def record_latency(phase: str, seconds: float, timings: TurnTimings | None = None) -> None:
+    latency_recorder.observe(phase, seconds)
+    if timings is not None:
+        timings.add(phase, seconds)
+
+
+@contextmanager
+def timed(phase: str, timings: TurnTimings | None = None) -> Iterator[None]:
+    """Record how long the block took under `phase`, process-wide and for the turn's `timings`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_latency(phase, time.perf_counter() - start, timings)
@@ -0,0 +1,125 @@
+import threading
+import uuid
+from pathlib import Path
+
+
+def truncate_output(text: str, max_bytes: int, max_lines: int) -> tuple[str, dict | None]:
+    """
+    Keep the head and tail of `text` within `max_bytes` and `max_lines`.
+
+    Returns the (possibly) truncated text and a summary of what was dropped, or None when the
+    text already fits.
+    """
+    lines = text.splitlines(keepends=True)
+    size = len(text.encode("utf-8", errors="replace"))
+    if len(lines) <= max_lines and size <= max_bytes:
+        return text, None
+
+    # the tail keeps at least one line: the end of the output usually holds the error or result
+    head_count = max(0, min(max_lines // 2, max_lines - 1))
+    tail_count = max(1, max_lines - head_count)
+    head_lines = lines[:head_count]
+    tail_lines = lines[max(0, len(lines) - tail_count):]
+    if len(head_lines) + len(tail_lines) >= len(lines):
+        # the line budget keeps every line, so only the byte budget cuts, across the whole text
+        head = tail = text
+    else:
+        head = "".join(head_lines)
+        tail = "".join(tail_lines)
+    # enforce the byte budget on top of the line budget, splitting it between head and tail
+    half = max_bytes // 2
+    head = head.encode("utf-8", errors="replace")[:half].decode("utf-8", errors="ignore")
+    tail_bytes = tail.encode("utf-8", errors="replace")
+    tail = tail_bytes[max(0, len(tail_bytes) - (max_bytes - half)):].decode("utf-8", errors="ignore")
+
+    # a line cut by the byte budget still counts as kept; when head and tail share a line it
+    # is counted twice, but then no line is dropped entirely
+    kept_lines = len(head.splitlines()) + len(tail.splitlines())
+    dropped_lines = max(0, len(lines) - kept_lines)
+    dropped_bytes = max(0, size - len(head.encode()) - len(tail.encode()))
+    marker = f"\n... [{dropped_lines} lines / {dropped_bytes} bytes truncated] ...\n"
+
+    return head + marker + tail, {
+        "total_lines": len(lines),
+        "total_bytes": size,
+        "dropped_lines": dropped_lines,
+        "dropped_bytes": dropped_bytes,
+    }
+
+
+class OutputLimiter:
+    """
+    Caps stdout/stderr returned to the model and spills the full text to an artifact file
+    under `artifact_dir` so the user can still download it. The oldest artifacts are deleted
+    once there are more than `max_artifacts` of them or they take more than
+    `max_artifact_bytes` in total.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 20000,
+        max_lines: int = 200,
+        artifact_dir: str = "artifacts",
+        max_artifacts: int = 1000,
+        max_artifact_bytes: int = 512 * 1024 * 1024,
+    ):
+        self.max_bytes = max_bytes
+        self.max_lines = max_lines
+        self.artifact_dir = Path(artifact_dir)
+        self.max_artifacts = max_artifacts
+        self.max_artifact_bytes = max_artifact_bytes
+        self._lock = threading.Lock()
+
+    def _spill(self, name: str, text: str) -> str:
+        self.artifact_dir.mkdir(parents=True, exist_ok=True)
+        path = self.artifact_dir / f"{uuid.uuid4().hex}-{name}.txt"
+        path.write_text(text, encoding="utf-8")
+        self._prune()
+        return str(path)
+
+    def _prune(self) -> None:
+        """Delete the oldest artifacts until both the count and the size cap hold."""
+        with self._lock:
+            artifacts = []
+            for path in self.artifact_dir.glob("*.txt"):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                artifacts.append((stat.st_mtime, stat.st_size, path))
+            artifacts.sort()
+
+            count = len(artifacts)
+            total = sum(size for _, size, _ in artifacts)
+            for _, size, path in artifacts:
+                # the newest artifact is kept even when it alone is over the size cap
+                if count <= 1 or (count <= self.max_artifacts and total <= self.max_artifact_bytes):
+                    break
+                path.unlink(missing_ok=True)
+                count -= 1
+                total -= size
+
+    def resolve(self, name: str) -> Path | None:
+        """Path of the artifact file called `name`, or None when there is no such artifact."""
+        if not name or Path(name).name != name:
+            return None
+        path = self.artifact_dir / name
+        return path if path.is_file() else None
+
+    def apply(self, result: dict) -> dict:
+        """Truncate the `stdout`/`stderr` entries of a tool result, recording what was dropped."""
+        truncated = {}
+        for name in ("stdout", "stderr"):
+            text = result.get(name)
+            if not text:
+                continue
+            limited, summary = truncate_output(text, self.max_bytes, self.max_lines)
+            if summary is None:
+                continue
+            summary["artifact"] = self._spill(name, text)
+            result[name] = limited
+            truncated[name] = summary
+
+        if truncated:
+            result["truncated"] = truncated
+        return result
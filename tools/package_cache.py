@@ -0,0 +1,246 @@
+import hashlib
+import json
+import os
+import re
+import shlex
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+from pathlib import Path
+
+WHEELHOUSE_MOUNT_PATH = "/wheelhouse"
+
+
+def normalize_requirements(libraries: list[str]) -> tuple[str, ...]:
+    """Normalize requirement strings so equivalent requirement sets hash the same."""
+    normalized = set()
+    for library in libraries:
+        library = library.strip()
+        if not library:
+            continue
+        # PEP 503 name normalization for the project name, keep any specifier as-is
+        match = re.match(r"^([A-Za-z0-9][A-Za-z0-9._-]*)(.*)$", library)
+        if match:
+            name, rest = match.groups()
+            library = re.sub(r"[-_.]+", "-", name).lower() + rest.replace(" ", "")
+        normalized.add(library)
+    return tuple(sorted(normalized))
+
+
+def requirements_key(requirements: tuple[str, ...]) -> str:
+    return hashlib.sha256("\n".join(requirements).encode()).hexdigest()
+
+
+def _sha256_of(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def container_id_of(session) -> str | None:
+    container = getattr(session, "container", None)
+    return getattr(container, "id", None)
+
+
+class PackageCache:
+    """
+    Content-addressed cache for `pip install` in sandbox containers.
+
+    Requirement sets are keyed by the hash of their normalized requirements. The cache records
+    which containers already have which sets, so repeated installs on the same container are
+    no-ops. When `host_dir` is set it is mounted read-only into the sandboxes as a wheelhouse:
+    the first install of a set builds its wheels in a separate builder container from
+    `builder_image`, and later installs (including on freshly recycled containers) install
+    offline from those wheels, once their hashes check out against the ones recorded at build
+    time. Sandboxes run untrusted code, so they never get to write to the wheelhouse.
+    """
+
+    def __init__(
+        self,
+        host_dir: str | None = None,
+        builder_image: str | None = None,
+        max_containers: int = 1024,
+        max_conversations: int = 4096,
+        on_install: Callable[[object], None] | None = None,
+    ):
+        self.host_dir = Path(host_dir).expanduser().resolve() if host_dir else None
+        if self.host_dir is not None:
+            for name in ("wheels", "sets", "staging"):
+                (self.host_dir / name).mkdir(parents=True, exist_ok=True)
+        self.builder_image = builder_image
+        self.max_containers = max_containers
+        self.max_conversations = max_conversations
+        # called with the session after packages were actually installed in its container
+        self.on_install = on_install
+        self._lock = threading.Lock()
+        # set key -> (build lock, number of installs using it); dropped once nobody does
+        self._build_locks: dict[str, tuple[threading.Lock, int]] = {}
+        self._docker_client = None
+        self._installed: OrderedDict[str, set[str]] = OrderedDict()
+        self._conversation_requirements: OrderedDict[str, list[tuple[str, ...]]] = OrderedDict()
+
+    @property
+    def runtime_configs(self) -> dict:
+        """Docker runtime configs mounting the wheelhouse read-only into sandbox containers."""
+        if self.host_dir is None:
+            return {}
+        return {"volumes": {str(self.host_dir): {"bind": WHEELHOUSE_MOUNT_PATH, "mode": "ro"}}}
+
+    def is_installed(self, container_id: str | None, key: str) -> bool:
+        if container_id is None:
+            return False
+        with self._lock:
+            return key in self._installed.get(container_id, ())
+
+    def _mark_installed(self, container_id: str | None, key: str) -> None:
+        if container_id is None:
+            return
+        with self._lock:
+            self._installed.setdefault(container_id, set()).add(key)
+            self._installed.move_to_end(container_id)
+            while len(self._installed) > self.max_containers:
+                self._installed.popitem(last=False)
+
+    def _has_wheels(self, key: str) -> bool:
+        """Whether the set's wheels were built and still match the hashes recorded for them."""
+        if self.host_dir is None:
+            return False
+        try:
+            recorded = json.loads((self.host_dir / "sets" / key).read_text())["wheels"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+
+        wheels_dir = self.host_dir / "wheels" / key
+        try:
+            present = {path.name for path in wheels_dir.iterdir()}
+        except OSError:
+            return False
+        if present != set(recorded):
+            return False
+        return all(_sha256_of(wheels_dir / name) == digest for name, digest in recorded.items())
+
+    def _build_wheels(self, key: str, requirements: tuple[str, ...]) -> tuple[int, str | None]:
+        """
+        Build the set's wheels in a throwaway builder container that can only write to a fresh
+        staging directory, then move them into the wheelhouse and record their hashes.
+
+        Returns the builder's exit code and stderr.
+        """
+        import docker
+
+        if self._docker_client is None:
+            self._docker_client = docker.from_env()
+
+        staging = Path(tempfile.mkdtemp(prefix=f"{key[:12]}-", dir=self.host_dir / "staging"))
+        try:
+            try:
+                self._docker_client.containers.run(
+                    self.builder_image,
+                    ["pip", "wheel", "--wheel-dir", "/build", *requirements],
+                    volumes={str(staging): {"bind": "/build", "mode": "rw"}},
+                    remove=True,
+                    stdout=False,
+                    stderr=True,
+                )
+            except docker.errors.ContainerError as error:
+                stderr = error.stderr.decode("utf-8", errors="replace") if error.stderr else None
+                return error.exit_status, stderr
+
+            wheels = {path.name: _sha256_of(path) for path in staging.iterdir() if path.suffix == ".whl"}
+            wheels_dir = self.host_dir / "wheels" / key
+            shutil.rmtree(wheels_dir, ignore_errors=True)
+            os.replace(staging, wheels_dir)
+            (self.host_dir / "sets" / key).write_text(
+                json.dumps({"requirements": list(requirements), "wheels": wheels}, indent=2) + "\n"
+            )
+            return 0, None
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def _ensure_wheels(self, key: str, requirements: tuple[str, ...]) -> tuple[int, str | None]:
+        # one build per set at a time; concurrent installs of the same set wait for it
+        with self._lock:
+            build_lock, users = self._build_locks.get(key, (threading.Lock(), 0))
+            self._build_locks[key] = (build_lock, users + 1)
+        try:
+            with build_lock:
+                if self._has_wheels(key):
+                    return 0, None
+                return self._build_wheels(key, requirements)
+        finally:
+            with self._lock:
+                build_lock, users = self._build_locks[key]
+                if users > 1:
+                    self._build_locks[key] = (build_lock, users - 1)
+                else:
+                    del self._build_locks[key]
+
+    def install(self, session, libraries: list[str]) -> dict:
+        """
+        Install `libraries` in the session's container unless it already has them.
+
+        Returns a dict with `exit_code`, `stderr` and `cached` (True when nothing had to be
+        installed).
+        """
+        requirements = normalize_requirements(libraries)
+        if not requirements:
+            return {"exit_code": 0, "stderr": None, "cached": True}
+
+        key = requirements_key(requirements)
+        container_id = container_id_of(session)
+        if self.is_installed(container_id, key):
+            return {"exit_code": 0, "stderr": None, "cached": True}
+
+        quoted = " ".join(shlex.quote(requirement) for requirement in requirements)
+        result = None
+        if self.host_dir is not None and self.builder_image is not None:
+            exit_code, stderr = self._ensure_wheels(key, requirements)
+            if exit_code != 0:
+                return {"exit_code": exit_code, "stderr": stderr, "cached": False}
+            result = session.execute_command(
+                f"pip install --no-index --find-links {WHEELHOUSE_MOUNT_PATH}/wheels/{key} {quoted}"
+            )
+        if result is None or result.exit_code != 0:
+            result = session.execute_command(f"pip install {quoted}")
+
+        if result.exit_code == 0:
+            self._mark_installed(container_id, key)
+            if self.on_install is not None:
+                self.on_install(session)
+
+        return {"exit_code": result.exit_code, "stderr": result.stderr, "cached": False}
+
+    def remember(self, conversation_id: str | None, libraries: list[str]) -> None:
+        """Remember that a conversation relies on `libraries`, so they can be restored on other containers."""
+        requirements = normalize_requirements(libraries)
+        if conversation_id is None or not requirements:
+            return
+        with self._lock:
+            remembered = self._conversation_requirements.setdefault(conversation_id, [])
+            if requirements not in remembered:
+                remembered.append(requirements)
+            # conversations that are never deleted still can't grow this without bound
+            self._conversation_requirements.move_to_end(conversation_id)
+            while len(self._conversation_requirements) > self.max_conversations:
+                self._conversation_requirements.popitem(last=False)
+
+    def forget(self, conversation_id: str) -> None:
+        """Drop the requirement sets remembered for a conversation that is gone."""
+        with self._lock:
+            self._conversation_requirements.pop(conversation_id, None)
+
+    def requirement_sets(self, conversation_id: str | None) -> list[tuple[str, ...]]:
+        if conversation_id is None:
+            return []
+        with self._lock:
+            return list(self._conversation_requirements.get(conversation_id, ()))
+
+    def restore(self, session, conversation_id: str | None) -> None:
+        """Make sure the session's container has every library the conversation installed so far."""
+        # restore set by set so each one hits the same cache key as the original install
+        for requirements in self.requirement_sets(conversation_id):
+            self.install(session, list(requirements))
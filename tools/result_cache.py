@@ -0,0 +1,67 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# code matching these is assumed to depend on more than its own text: randomness, the clock,
+# the network, the environment or files whose contents the cache key cannot see
+NON_DETERMINISTIC_PATTERN = re.compile(
+    r"\b(random|secrets|uuid|time\.time|datetime\.now|datetime\.today|date\.today|"
+    r"requests|urllib|httpx|socket|os\.environ|input\s*\(|open\s*\(|read_\w+\s*\(|"
+    r"loadtxt|genfromtxt|Path\()"
+)
+
+
+def is_probably_deterministic(code: str) -> bool:
+    return NON_DETERMINISTIC_PATTERN.search(code) is None
+
+
+def result_key(code: str, *parts: str) -> str:
+    digest = hashlib.sha256(code.encode())
+    for part in parts:
+        digest.update(b"\0")
+        digest.update(part.encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """LRU cache of execution results with a per-entry TTL (seconds, None for no expiry)."""
+
+    def __init__(self, max_entries: int = 256, ttl: float | None = 600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+
+            if entry is None:
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return dict(entry[1])
+
+    def put(self, key: str, result: dict) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic(), dict(result))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+            }
@@ -0,0 +1,54 @@
+import threading
+from collections.abc import Callable
+
+
+class RunControl:
+    """
+    Stops a blocking sandbox run from another thread, either because its wall-clock `timeout`
+    (seconds, None for no limit) elapsed or because the caller was cancelled.
+    """
+
+    def __init__(self, timeout: float | None = None):
+        self.timeout = timeout
+        self.cancelled = False
+        self.timed_out = False
+        self._stop = threading.Event()
+        self._finished = False
+        self._lock = threading.Lock()
+
+    @property
+    def killed(self) -> bool:
+        return self.cancelled or self.timed_out
+
+    def cancel(self) -> None:
+        with self._lock:
+            if not self._finished:
+                self.cancelled = True
+        self._stop.set()
+
+    def watch(self, kill: Callable[[], None]) -> None:
+        """Call `kill` if the run is cancelled or times out before `finish` is called."""
+        if self.cancelled:
+            kill()
+            return
+
+        def _watchdog():
+            stopped = self._stop.wait(self.timeout)
+            with self._lock:
+                if self._finished:
+                    return
+                if not stopped:
+                    self.timed_out = True
+            kill()
+
+        threading.Thread(target=_watchdog, daemon=True, name="sandbox-watchdog").start()
+
+    def finish(self) -> None:
+        with self._lock:
+            self._finished = True
+        self._stop.set()
+
+    def describe(self) -> str:
+        if self.timed_out:
+            return f"Execution timed out after {self.timeout} seconds and the sandbox was recycled."
+        return "Execution was cancelled and the sandbox was recycled."
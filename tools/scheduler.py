@@ -0,0 +1,157 @@
+import asyncio
+import threading
+import time
+from collections import defaultdict, deque
+from collections.abc import AsyncIterator
+from concurrent.futures import Future
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+
+from tools.metrics import summarize_durations
+
+
+def parse_weights(value: str) -> dict[str, float]:
+    """Parse `tenant=weight,tenant=weight` into a dict."""
+    weights = {}
+    for item in value.split(","):
+        tenant, _, weight = item.partition("=")
+        if tenant.strip() and weight.strip():
+            weights[tenant.strip()] = float(weight)
+    return weights
+
+
+@dataclass
+class _Waiter:
+    tenant: str
+    conversation_id: str
+    start_tag: float
+    seq: int
+    future: Future = field(default_factory=Future)
+
+
+class FairScheduler:
+    """
+    Admission control with per-tenant and per-conversation concurrency limits and weighted
+    fair queuing between tenants.
+
+    At most `capacity` holders run at once, at most `tenant_limit` per tenant and
+    `conversation_limit` per conversation. Queued requests are served by start-time fair
+    queuing: each tenant's requests are tagged with a virtual start time that advances by
+    `cost / weight` per request, so a tenant with weight 2 gets twice the share of a tenant with
+    weight 1 under contention and one heavy tenant cannot monopolize the capacity. Waiting uses
+    thread-safe futures so one scheduler can serve several event loops.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        tenant_limit: int | None = None,
+        conversation_limit: int | None = None,
+        weights: dict[str, float] | None = None,
+        wait_samples: int = 1000,
+    ):
+        self.capacity = capacity
+        self.tenant_limit = tenant_limit
+        self.conversation_limit = conversation_limit
+        self.weights = weights or {}
+        self._lock = threading.Lock()
+        self._running = 0
+        self._tenant_running: defaultdict[str, int] = defaultdict(int)
+        self._conversation_running: defaultdict[str, int] = defaultdict(int)
+        self._waiters: list[_Waiter] = []
+        self._virtual_time = 0.0
+        self._tenant_finish: dict[str, float] = {}
+        self._seq = 0
+        self._wait_seconds: deque[float] = deque(maxlen=wait_samples)
+
+    def _eligible(self, tenant: str, conversation_id: str) -> bool:
+        return (
+            self._running < self.capacity
+            and (self.tenant_limit is None or self._tenant_running[tenant] < self.tenant_limit)
+            and (
+                self.conversation_limit is None
+                or self._conversation_running[conversation_id] < self.conversation_limit
+            )
+        )
+
+    def _start(self, tenant: str, conversation_id: str) -> None:
+        self._running += 1
+        self._tenant_running[tenant] += 1
+        self._conversation_running[conversation_id] += 1
+
+    def _dispatch(self) -> None:
+        """Admit queued waiters in fair order while capacity allows (must hold lock)."""
+        self._waiters.sort(key=lambda waiter: (waiter.start_tag, waiter.seq))
+        index = 0
+        while index < len(self._waiters) and self._running < self.capacity:
+            waiter = self._waiters[index]
+            if not self._eligible(waiter.tenant, waiter.conversation_id):
+                index += 1
+                continue
+            del self._waiters[index]
+            if waiter.future.set_running_or_notify_cancel():
+                self._start(waiter.tenant, waiter.conversation_id)
+                self._virtual_time = max(self._virtual_time, waiter.start_tag)
+                waiter.future.set_result(None)
+
+    def _release(self, tenant: str, conversation_id: str) -> None:
+        with self._lock:
+            self._running -= 1
+            self._tenant_running[tenant] -= 1
+            if not self._tenant_running[tenant]:
+                del self._tenant_running[tenant]
+            self._conversation_running[conversation_id] -= 1
+            if not self._conversation_running[conversation_id]:
+                del self._conversation_running[conversation_id]
+            self._dispatch()
+
+    async def _acquire(self, tenant: str, conversation_id: str, cost: float) -> None:
+        requested_at = time.perf_counter()
+        with self._lock:
+            start_tag = max(self._virtual_time, self._tenant_finish.get(tenant, 0.0))
+            self._tenant_finish[tenant] = start_tag + cost / self.weights.get(tenant, 1.0)
+            self._seq += 1
+            waiter = _Waiter(tenant, conversation_id, start_tag, self._seq)
+            self._waiters.append(waiter)
+            self._dispatch()
+
+        try:
+            await asyncio.wrap_future(waiter.future)
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                granted = waiter.future.done() and not waiter.future.cancelled()
+            if granted:
+                # admitted just before the cancellation landed, give the slot back
+                self._release(tenant, conversation_id)
+            raise
+
+        with self._lock:
+            self._wait_seconds.append(time.perf_counter() - requested_at)
+
+    @asynccontextmanager
+    async def slot(self, tenant: str, conversation_id: str, cost: float = 1.0) -> AsyncIterator[None]:
+        await self._acquire(tenant, conversation_id, cost)
+        try:
+            yield
+        finally:
+            self._release(tenant, conversation_id)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            queued_by_tenant: defaultdict[str, int] = defaultdict(int)
+            for waiter in self._waiters:
+                queued_by_tenant[waiter.tenant] += 1
+            stats = {
+                "capacity": self.capacity,
+                "running": self._running,
+                "queued": len(self._waiters),
+                "running_by_tenant": dict(self._tenant_running),
+                "queued_by_tenant": dict(queued_by_tenant),
+            }
+            waits = list(self._wait_seconds)
+
+        if waits:
+            stats["wait_seconds"] = summarize_durations(waits)
+        return stats